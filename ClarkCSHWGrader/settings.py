@@ -1,4 +1,5 @@
 from pathlib import Path
+import os
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = 'yge7&9=pn(g*(c-5o3di42+hz&d_c16+g)oea7gdshhu_n!3+3'
@@ -146,6 +147,50 @@ TEMP_DIR = MEDIA_ROOT / 'tmp'
 # Autograder settings
 AUTOGRADER_DIR = BASE_DIR / 'autograder' # Location of autograder .zip files
 AUTOGRADE_SCRIPT = BASE_DIR / 'autograder' / 'autograde.sh'
+AUTOGRADER_WORK_DIR = Path('/tmp/athena-autograder') # Per-submission working directories
+AUTOGRADER_WORK_MAX_SIZE = 10 * 1024**3 # in bytes, idle working directories removed past this
+AUTOGRADER_RESULTS_MAX_SIZE = 16 * 1024**2 # in bytes, larger results.json files fail the run
+
+# Runs with small zips work in RAM under this tmpfs directory instead (None to
+# disable), as long as the RAM budget has room for another workspace
+AUTOGRADER_TMPFS_DIR = Path('/dev/shm/athena-autograder')
+AUTOGRADER_TMPFS_MAX_ZIP_SIZE = 16 * 1024**2 # in bytes, autograder and submission zips combined
+AUTOGRADER_TMPFS_WORKSPACE_SIZE = 256 * 1024**2 # in bytes, RAM set aside for each workspace
+AUTOGRADER_TMPFS_BUDGET = 2 * 1024**3 # in bytes, RAM all workspaces on a host may take
+
+# Extracted autograders are cached here and hardlinked into each working
+# directory, so keep it on the same filesystem as AUTOGRADER_WORK_DIR
+AUTOGRADER_CACHE_DIR = Path('/tmp/athena-autograder-cache')
+AUTOGRADER_CACHE_MAX_SIZE = 2 * 1024**3 # in bytes, least recently used entries evicted past this
+AUTOGRADER_DEPS_TIMEOUT = 1800 # in seconds, time allowed to build an autograder's dependency cache
+AUTOGRADER_LEASE_TIME = 60 # in seconds, an attempt that stops renewing its lease this long is given up on
+
+# Autograder runs are limited through a cgroup v2 group created under this
+# directory, which must be delegated to the user running the qcluster.
+# If it isn't writable, runs fall back to rlimits (see grader/sandbox.py)
+AUTOGRADER_CGROUP_ROOT = Path('/sys/fs/cgroup/athena-autograder')
+AUTOGRADER_CPU_PINNING = True # Pin each concurrent run to its own cores
+
+# Autograder workers on other hosts (see docs/autograde.md)
+# On a worker host, set ATHENA_REMOTE_URL to the web host's URL to fetch zips
+# from it and push results back to it instead of using its paths directly.
+# The web host and its workers must share the same ATHENA_WORKER_TOKEN
+AUTOGRADER_REMOTE_URL = os.environ.get('ATHENA_REMOTE_URL')
+AUTOGRADER_WORKER_TOKEN = os.environ.get('ATHENA_WORKER_TOKEN')
+AUTOGRADER_ARTIFACT_DIR = Path('/tmp/athena-artifacts') # Zips fetched by a worker host
+AUTOGRADER_ARTIFACT_MAX_SIZE = 2 * 1024**3 # in bytes, least recently used zips removed past this
+AUTOGRADER_PUSH_MAX_SIZE = 256 * 1024**2 # in bytes, results and log a worker may push for a job, unzipped
+
+# Bearer token Prometheus must send to scrape the plain-text autograder
+# metrics at /metrics, which are not served at all while it is unset
+METRICS_TOKEN = os.environ.get('ATHENA_METRICS_TOKEN')
+
+# Cache holding each user's course roles, see grader/roles.py. Roster and group
+# changes reach processes sharing this cache at once and others within
+# ROLE_CACHE_TIMEOUT seconds, so with several web processes point it at a
+# shared cache such as memcached
+ROLE_CACHE = 'default'
+ROLE_CACHE_TIMEOUT = 60 # in seconds
 
 #Email host to use for usernames
 DEFAULT_EMAIL_HOST = "clarku.edu"
@@ -175,4 +220,29 @@ Q_CLUSTER = {
     'save_limit': 100,
     'queue_limit': 36,
     'label': 'Autograder Queue',
-}
\ No newline at end of file
+}
+
+# Number of autograder jobs handed to the cluster at once, see grader/scheduler.py
+# Jobs beyond this wait in the scheduler and are shared fairly between courses
+AUTOGRADER_SLOTS = Q_CLUSTER['workers']
+
+# Most shards a sharded autograder (see docs/autograde.md) is split into
+AUTOGRADER_MAX_SHARDS = AUTOGRADER_SLOTS
+
+# Most submissions from one bulk regrade handed to the scheduler at once
+AUTOGRADER_REGRADE_CHUNK = 2 * AUTOGRADER_SLOTS
+
+# Bounds on the worker pool kept by ./manage.py autoscale (see docs/autograde.md),
+# which starts qclusters of AUTOSCALE_CLUSTER_WORKERS workers each
+AUTOSCALE_MIN_WORKERS = 2
+AUTOSCALE_MAX_WORKERS = AUTOGRADER_SLOTS
+AUTOSCALE_CLUSTER_WORKERS = 2
+AUTOSCALE_INTERVAL = 30 # in seconds, between scaling decisions
+AUTOSCALE_COOLDOWN = 600 # in seconds, the pool doesn't shrink this soon after growing
+AUTOSCALE_LEAD_TIME = 3600 # in seconds, how long before a due date to scale up for it
+AUTOSCALE_MAX_LOAD = 1.5 # load average per core above which the pool stops growing
+
+# Size of a qcluster started by ./manage.py autoscale; set after everything
+# derived from Q_CLUSTER['workers'] so those keep the configured value
+if 'ATHENA_QCLUSTER_WORKERS' in os.environ:
+    Q_CLUSTER['workers'] = int(os.environ['ATHENA_QCLUSTER_WORKERS'])
@@ -3,37 +3,66 @@
 set -euo pipefail
 
 base_dir="$1"
-autograder_zip="$2"
+autograder="$2" # Either the autograder zip or its extracted tree in the cache
 submission_zip="$3"
 reports_dir="$4"
 logfile="$5"
+timings="${6:-/dev/null}"
+
+# Write how long each phase took to the timings file, as "phase <name> <microseconds>"
+# These are stored as AutograderTimings, see grader/metrics.py
+phase_start=$(date +%s%N)
+end_phase() {
+    local now=$(date +%s%N)
+    echo "phase $1 $(( (now - phase_start) / 1000 ))" >> "$timings"
+    phase_start=$now
+}
+
+# Sharded autograders run once per shard, see docs/autograde.md
+if [ -n "${ATHENA_SHARD_COUNT:-}" ]; then
+    echo "=== Shard $ATHENA_SHARD_INDEX of $ATHENA_SHARD_COUNT ===" >> "$logfile"
+fi
 
 # Make and enter the base directory
 mkdir -p "$base_dir"
 cd "$base_dir"
 
-# Unzip the autograder here
-echo "=== Unzipping the autograder ===" >> "$logfile"
-unzip "$autograder_zip" -d "$base_dir" >> "$logfile"
+# Link the cached autograder tree here, or unzip the autograder if not cached
+if [ -d "$autograder" ]; then
+    echo "=== Linking the cached autograder ===" >> "$logfile"
+    # Hardlinks only work within a filesystem, e.g. not from the cache into RAM
+    if [ "$(stat -c %d "$autograder")" = "$(stat -c %d "$base_dir")" ]; then
+        cp -alf "$autograder/." "$base_dir" 2> /dev/null || cp -af "$autograder/." "$base_dir"
+    else
+        cp -af "$autograder/." "$base_dir"
+    fi
+else
+    echo "=== Unzipping the autograder ===" >> "$logfile"
+    unzip -o "$autograder" -d "$base_dir" >> "$logfile"
+fi
+end_phase autograder
 
 # Make 'sumbission' subdir and place submission there
 echo "=== Unzipping the submission ===" >> "$logfile"
 mkdir -p "submission"
-unzip "$submission_zip" -d "submission/" >> "$logfile"
+unzip -o "$submission_zip" -d "submission/" >> "$logfile"
+end_phase submission
 
 # Run the run_autograder script that should be in here
 mkdir -p 'results'
 echo "=== Running autograder ===" >> "$logfile"
 chmod +x run_autograder
 . run_autograder &>> "$logfile"
+end_phase run
 
-# Copy results into the submission reports directory
-echo "=== Copying results to reports directory ===" >> "$logfile"
+# Move results into the submission reports directory, which is a rename if
+# both are on the same filesystem. Whatever can't be moved (e.g. a directory
+# already in the reports directory) is copied
+echo "=== Moving results to reports directory ===" >> "$logfile"
 mkdir -p "$reports_dir"
-cp -r results/* "$reports_dir"
-
-# Clean up after ourselves
+mv -f results/* "$reports_dir" 2> /dev/null || cp -r results/* "$reports_dir"
+end_phase results
 
-echo "=== Cleaning up ===" >> "$logfile"
-cd ..
-#rm -rf "$base_dir"
\ No newline at end of file
+# The worker moves the base directory to the trash once we're done, and it
+# is deleted in the background (see grader/workspace.py)
+cd ..
\ No newline at end of file
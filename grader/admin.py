@@ -7,3 +7,31 @@ admin.site.register(Submission)
 admin.site.register(Grade)
 admin.site.register(Semester)
 admin.site.register(AutograderResult)
+
+
+class AutogradeJobAdmin(admin.ModelAdmin):
+    list_display = ('result', 'course', 'assignment', 'state', 'attempt', 'lease_owner', 'enqueued_at', 'get_queue_wait')
+    list_filter = ('state', 'course')
+
+admin.site.register(AutogradeJob, AutogradeJobAdmin)
+
+
+class AutograderTimingAdmin(admin.ModelAdmin):
+    list_display = ('assignment', 'result', 'shard_index', 'phase', 'seconds', 'created')
+    list_filter = ('phase', 'assignment__course')
+
+admin.site.register(AutograderTiming, AutograderTimingAdmin)
+
+
+class TestResultAdmin(admin.ModelAdmin):
+    list_display = ('result', 'number', 'name', 'score', 'max_score', 'passed')
+    list_filter = ('passed', 'assignment')
+
+admin.site.register(TestResult, TestResultAdmin)
+
+
+class ScalingDecisionAdmin(admin.ModelAdmin):
+    list_display = ('created', 'previous', 'workers', 'reason', 'queued', 'running', 'predicted', 'load')
+    list_filter = ('reason',)
+
+admin.site.register(ScalingDecision, ScalingDecisionAdmin)
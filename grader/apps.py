@@ -0,0 +1,24 @@
+from django.apps import AppConfig
+from django.db import DatabaseError
+import sys
+
+
+class GraderConfig(AppConfig):
+    name = 'grader'
+
+    def ready(self):
+        """
+        Keeps cached course roles up to date, and requeues the jobs of dead
+        workers whenever a qcluster starts, rather than wait for the
+        reclaim-leases schedule
+        """
+        from grader import roles
+        roles.connect()
+
+        if sys.argv[1:2] == ['qcluster']:
+            from grader import lease
+            try:
+                lease.reclaim()
+            except DatabaseError:
+                #Nothing to reclaim before the first migration
+                pass
@@ -0,0 +1,336 @@
+"""
+Content-addressed cache of extracted autograder zips
+
+Every autograder zip is extracted once into AUTOGRADER_CACHE_DIR/<sha256>/tree
+and each run gets a hardlinked view of that tree instead of unzipping the zip
+again. Entries are keyed by a hash of the zip contents, so replacing the zip
+behind an assignment automatically produces a new entry; old entries fall out
+through LRU eviction once the cache grows past AUTOGRADER_CACHE_MAX_SIZE.
+A run holds a shared lock on its entry for as long as it uses the entry
+(see use_extracted), and eviction skips entries that are locked.
+
+An autograder with a setup_autograder script also gets a dependency cache,
+AUTOGRADER_CACHE_DIR/<sha256>/deps. The script is run once, by the first run
+of that autograder version, to fill the directory (e.g. with a venv or a
+Maven repository); the directory is then made read-only and handed to every
+later run as ATHENA_DEPS_DIR. A failed build is recorded, and later runs of
+that version go without the cache rather than build it again.
+"""
+
+from django.conf import settings
+from zipfile import ZipFile
+from pathlib import Path
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import time
+
+from grader import sandbox
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+#Name of the extracted tree, size file and in-use lock file within a cache entry
+TREE_DIR = 'tree'
+SIZE_FILE = 'size'
+IN_USE_FILE = '.in-use'
+
+#Optional file at the root of an autograder zip with settings for Athena
+MANIFEST_FILE = 'athena.json'
+
+#Optional script at the root of an autograder zip that builds its dependency
+#cache, and the directories and files of a cache entry used for it
+SETUP_SCRIPT = 'setup_autograder'
+DEPS_DIR = 'deps'
+DEPS_DONE_FILE = 'deps.done'
+DEPS_FAILED_FILE = 'deps.failed'
+DEPS_LOCK_FILE = '.deps.lock'
+
+#Memoized hashes, keyed by (path, size, mtime) so a swapped zip is rehashed
+_hash_memo = dict()
+
+
+def hash_file(path):
+    """
+    Returns the sha256 hex digest of a file
+    Hashes are memoized on path, size and modification time
+    """
+    path = Path(path).resolve()
+    info = path.stat()
+    key = (str(path), info.st_size, info.st_mtime_ns)
+
+    if key not in _hash_memo:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        _hash_memo[key] = digest.hexdigest()
+
+    return _hash_memo[key]
+
+
+def get_cache_dir():
+    """
+    Returns the root directory of the cache, creating it if needed
+    """
+    cache_dir = Path(settings.AUTOGRADER_CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def get_extracted(autograder_zip):
+    """
+    Returns the path to the extracted tree of an autograder zip
+    Extracts the zip into the cache on a miss and marks the entry as recently used
+    The tree may be evicted at any time after this returns; runs that keep
+    using it should call use_extracted instead
+    """
+    tree, lock = use_extracted(autograder_zip)
+    lock.close()
+    return tree
+
+
+def use_extracted(autograder_zip):
+    """
+    Returns (path to the extracted tree of an autograder zip, lock file)
+    Extracts the zip into the cache on a miss and marks the entry as recently used
+    The entry, including its dependency cache, is not evicted until the lock
+    file is closed
+    """
+    entry = get_cache_dir() / hash_file(autograder_zip)
+    tree = entry / TREE_DIR
+
+    #An entry evicted between extracting and locking it is extracted again
+    lock = None
+    while not lock:
+        if not tree.exists():
+            _extract(autograder_zip, entry)
+        lock = lock_entry(entry)
+    evict()
+
+    #Directory mtime doubles as the last-used time for LRU eviction
+    os.utime(entry)
+    return tree, lock
+
+
+def lock_entry(entry, exclusive=False):
+    """
+    Locks a cache entry as in use, shared unless exclusive
+    Returns the lock file, or None if the entry is gone or, for an exclusive
+    lock, in use
+    """
+    try:
+        lock = open(entry / IN_USE_FILE, 'a')
+    except FileNotFoundError:
+        return None
+
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB if exclusive else fcntl.LOCK_SH)
+        #Eviction renames the entry away while holding the lock
+        if os.fstat(lock.fileno()).st_ino != os.stat(entry / IN_USE_FILE).st_ino:
+            raise FileNotFoundError()
+    except OSError:
+        lock.close()
+        return None
+
+    return lock
+
+
+def read_manifest(tree):
+    """
+    Returns the manifest of an extracted autograder as a dict
+    Autograders without a manifest, or with an unreadable one, get an empty dict
+    """
+    try:
+        with open(Path(tree) / MANIFEST_FILE) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return dict()
+    except ValueError as e:
+        print(f'Ignoring unreadable {MANIFEST_FILE} in {tree}: {e}')
+        return dict()
+
+    return manifest if isinstance(manifest, dict) else dict()
+
+
+def needs_deps_build(autograder_hash):
+    """
+    Returns whether the next run of an autograder version will build its dependency cache
+    """
+    entry = get_cache_dir() / autograder_hash
+    if not (entry / TREE_DIR).exists():
+        return True
+    return (entry / TREE_DIR / SETUP_SCRIPT).exists() and not (entry / DEPS_DONE_FILE).exists() \
+        and not (entry / DEPS_FAILED_FILE).exists()
+
+
+def get_deps(tree, limits, log):
+    """
+    Returns the dependency cache of an extracted autograder as (path, built),
+    building it first if this is the first run of the autograder version
+    built is True if this call built the cache; path is None if the
+    autograder has no setup script or the setup script failed, now or on
+    an earlier run
+    limits are the resource limits for the setup script, whose output goes to log
+    """
+    tree = Path(tree)
+    entry = tree.parent
+    deps = entry / DEPS_DIR
+    if not (tree / SETUP_SCRIPT).exists():
+        return None, False
+    if (entry / DEPS_DONE_FILE).exists():
+        return deps, False
+    if (entry / DEPS_FAILED_FILE).exists():
+        return None, False
+
+    #Only one worker builds; any others wait for it and then use its cache
+    with open(entry / DEPS_LOCK_FILE, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if (entry / DEPS_DONE_FILE).exists():
+            return deps, False
+        if (entry / DEPS_FAILED_FILE).exists():
+            return None, False
+
+        #Built in place, since venvs and the like hardcode their own path
+        shutil.rmtree(deps, ignore_errors=True)
+        deps.mkdir()
+
+        #The script runs from the autograder tree so it can read files such
+        #as requirements.txt, and writes into ATHENA_DEPS_DIR
+        log.write(b'=== Building the dependency cache ===\n')
+        log.flush()
+        proc = sandbox.run_limited(['bash', tree / SETUP_SCRIPT], limits, {'ATHENA_DEPS_DIR': str(deps)},
+                                   cwd=tree, stdout=log, stderr=subprocess.STDOUT)
+        if proc.returncode != 0:
+            #Flushed now so the line comes before the run's own output
+            log.write(b'=== Building the dependency cache failed ===\n')
+            log.flush()
+            shutil.rmtree(deps, ignore_errors=True)
+            (entry / DEPS_FAILED_FILE).write_text(str(time.time()))
+            return None, True
+
+        #Runs share the cache, so make it read-only like the tree, directories
+        #included so no run can add, remove or replace files for later runs
+        size = int((entry / SIZE_FILE).read_text())
+        for path, dirs, files in os.walk(deps, topdown=False):
+            for f in files:
+                fpath = os.path.join(path, f)
+                if not os.path.islink(fpath):
+                    _make_read_only(fpath)
+                    size += os.path.getsize(fpath)
+            for d in dirs:
+                if not os.path.islink(os.path.join(path, d)):
+                    _make_read_only(os.path.join(path, d))
+        _make_read_only(deps)
+        (entry / SIZE_FILE).write_text(str(size))
+        (entry / DEPS_DONE_FILE).write_text(str(time.time()))
+
+    return deps, True
+
+
+def _make_read_only(path):
+    """
+    Removes write permission from a file or directory
+    """
+    mode = os.stat(path).st_mode
+    os.chmod(path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def _remove(path):
+    """
+    Deletes a cache entry, first making the read-only directories of its
+    dependency cache writable again so their files can be removed
+    """
+    for dirpath, dirs, files in os.walk(path):
+        for d in dirs:
+            dpath = os.path.join(dirpath, d)
+            if not os.path.islink(dpath):
+                os.chmod(dpath, os.stat(dpath).st_mode | stat.S_IWUSR)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def _extract(autograder_zip, entry):
+    """
+    Extracts a zip into a cache entry
+    Extraction happens in a scratch directory that is renamed into place,
+    so concurrent callers never see a half-extracted tree
+    """
+    scratch = Path(tempfile.mkdtemp(dir=get_cache_dir(), prefix='.extract-'))
+    try:
+        with ZipFile(autograder_zip) as z:
+            z.extractall(scratch / TREE_DIR)
+
+        #Files are shared by hardlink between runs, so make them read-only
+        #to keep one run from modifying the cached copy in place
+        size = 0
+        for path, dirs, files in os.walk(scratch / TREE_DIR):
+            for f in files:
+                fpath = os.path.join(path, f)
+                mode = os.stat(fpath).st_mode
+                os.chmod(fpath, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+                size += os.path.getsize(fpath)
+        (scratch / SIZE_FILE).write_text(str(size))
+
+        try:
+            os.rename(scratch, entry)
+        except OSError:
+            #Another process extracted the same zip first
+            if not (entry / TREE_DIR).exists():
+                raise
+    finally:
+        if scratch.exists():
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+def get_entries():
+    """
+    Returns list of cache entries in the form (path, size, last used), least recently used first
+    """
+    entries = list()
+    for entry in get_cache_dir().iterdir():
+        if entry.name.startswith('.'):
+            continue
+        try:
+            size = int((entry / SIZE_FILE).read_text())
+            entries.append((entry, size, entry.stat().st_mtime))
+        except (OSError, ValueError):
+            continue
+
+    return sorted(entries, key=lambda e: e[2])
+
+
+def evict(max_size=None):
+    """
+    Removes least recently used entries until the cache fits within max_size bytes
+    Entries a run has locked with use_extracted are kept
+    """
+    if max_size is None:
+        max_size = settings.AUTOGRADER_CACHE_MAX_SIZE
+
+    entries = get_entries()
+    total = sum(size for entry, size, used in entries)
+
+    #Always keep the most recently used entry
+    for entry, size, used in entries[:-1]:
+        if total <= max_size:
+            break
+
+        lock = lock_entry(entry, exclusive=True)
+        if not lock:
+            continue
+
+        #Rename first so nobody links from a partially deleted tree
+        doomed = entry.with_name('.evict-%s' % entry.name)
+        try:
+            os.rename(entry, doomed)
+        except OSError:
+            lock.close()
+            continue
+        _remove(doomed)
+        lock.close()
+        total -= size
@@ -0,0 +1,127 @@
+"""
+Sizing of the autograder worker pool
+
+./manage.py autoscale supervises a pool of qcluster processes of
+AUTOSCALE_CLUSTER_WORKERS workers each. Every AUTOSCALE_INTERVAL seconds it
+asks get_target() how many workers are wanted, between AUTOSCALE_MIN_WORKERS
+and AUTOSCALE_MAX_WORKERS:
+
+- Reactively, one per job queued or running
+- Predictively, enough for the rush before the due date of each autograded
+  assignment due within AUTOSCALE_LEAD_TIME: every enrolled student submitting
+  once over that time, each run taking the autograder's RuntimeEstimate
+
+The pool stops growing while the host's load average per core is over
+AUTOSCALE_MAX_LOAD, and only shrinks AUTOSCALE_COOLDOWN after it last grew.
+Every change is stored as a ScalingDecision, and the scheduler dispatches no
+more jobs at once than the latest decision allows.
+"""
+
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+from datetime import timedelta
+import logging
+import math
+import os
+
+from grader.models import Assignment, AutogradeJob, RuntimeEstimate, ScalingDecision
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_pool_size():
+    """
+    Returns the number of workers the autoscaler last settled on, or None if
+    it isn't running
+    """
+    decision = ScalingDecision.objects.order_by('-created', '-id').first()
+    return decision.workers if decision else None
+
+
+def get_load():
+    """
+    Returns the host's one minute load average per core
+    """
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return 0
+
+
+def get_predicted(now=None):
+    """
+    Returns the number of workers wanted for the autograded assignments due
+    within AUTOSCALE_LEAD_TIME, by Little's law: each assignment's students
+    submit at a rate of one per student over the lead time, and each run
+    holds a worker for the autograder's expected run time
+    """
+    now = now or timezone.now()
+    lead = settings.AUTOSCALE_LEAD_TIME
+    assgns = list(Assignment.objects.filter(autograde_mode=Assignment.AUTOGRADE,
+                                            due_date__gte=now, due_date__lte=now + timedelta(seconds=lead))
+                  .annotate(num_students=Count('course__students')))
+
+    #No hash, so each assignment's most recent estimate is used
+    estimates = RuntimeEstimate.get_estimates((a.id, '') for a in assgns)
+    return math.ceil(sum(a.num_students * estimates.get((a.id, ''), RuntimeEstimate.DEFAULT_SECONDS) / lead
+                         for a in assgns))
+
+
+def get_target(current, last_grown=None, now=None):
+    """
+    Returns (workers, ScalingDecision) for a pool of current workers that last
+    grew at last_grown; the decision is unsaved and the workers are a whole
+    number of clusters
+    """
+    now = now or timezone.now()
+    step = settings.AUTOSCALE_CLUSTER_WORKERS
+
+    states = list(AutogradeJob.objects.exclude(state=AutogradeJob.ST_DONE).values_list('state', flat=True))
+    running = sum(1 for s in states if s in (AutogradeJob.ST_DISPATCHED, AutogradeJob.ST_RUNNING))
+    queued = len(states) - running
+    predicted = get_predicted(now)
+    load = get_load()
+
+    wanted = max(running + queued, predicted)
+    reason = 'predicted' if predicted > running + queued else 'queue'
+    target = min(max(wanted, settings.AUTOSCALE_MIN_WORKERS), settings.AUTOSCALE_MAX_WORKERS)
+    if target == settings.AUTOSCALE_MIN_WORKERS and wanted < target:
+        reason = 'minimum'
+    elif target == settings.AUTOSCALE_MAX_WORKERS and wanted > target:
+        reason = 'maximum'
+
+    if target > current and load > settings.AUTOSCALE_MAX_LOAD:
+        target, reason = max(current, settings.AUTOSCALE_MIN_WORKERS), 'load %.2f' % load
+
+    #Running jobs finish either way, so there is no point stopping their workers early
+    if target < current:
+        if last_grown and now - last_grown < timedelta(seconds=settings.AUTOSCALE_COOLDOWN):
+            target, reason = current, 'cooldown'
+        else:
+            target = max(target, running)
+
+    workers = max(step, math.ceil(target / step) * step)
+    decision = ScalingDecision(workers=workers, previous=current, queued=queued, running=running,
+                               predicted=predicted, load=load, reason=reason)
+    logger.debug("Autoscale: %d queued, %d running, %d predicted, load %.2f: %d -> %d workers (%s)",
+                 queued, running, predicted, load, current, workers, reason)
+    return workers, decision
+
+
+def record(decision):
+    """
+    Stores a change in the number of workers
+    """
+    decision.save()
+    logger.info("Autoscale: %s -> %s workers (%s; %d queued, %d running, %d predicted, load %.2f)",
+                decision.previous, decision.workers, decision.reason, decision.queued,
+                decision.running, decision.predicted, decision.load)
+
+
+def record_stopped(current):
+    """
+    Records that the autoscaler has stopped, so the scheduler goes back to AUTOGRADER_SLOTS
+    """
+    record(ScalingDecision(workers=None, previous=current, reason='stopped'))
@@ -1,12 +1,26 @@
 from django.shortcuts import render
 from django.http import *
 from django.urls import reverse
+from django.conf import settings
 
 from grader.models import *
 from grader.forms import *
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from grader import autograder_cache, regrade, remote
+import grader.tasks
 
+from zipfile import ZipFile
 import os
+import codecs
+import hashlib
+import json
 import mimetypes
+import shutil
+
+
+#Most bytes of autograder output returned by a single log request
+LOG_CHUNK_SIZE = 64 * 1024
 
 
 def submission_download(request, subid, subdir=None, filename=None):
@@ -38,6 +52,124 @@ def submission_download(request, subid, subdir=None, filename=None):
         return get_download(os.path.join(sub.get_directory(), sub.get_filename()))
 
 
+def autograde_log(request, subid):
+    """
+    Returns output appended to a submission's autograder log since a byte offset
+    Clients pass the offset from their previous response in the "offset" query
+    parameter and poll again until "done", so the log is never re-fetched and
+    no request waits on the autograder
+    """
+    
+    #Make sure user is logged in
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'not logged in'}, status=403)
+    
+    #Get the submission
+    sub = Submission.objects.select_related('assignment__course', 'autograderresult').get(id=subid)
+    
+    #Make sure user should be able to see the autograder output
+    course = sub.assignment.course
+    if not (course.has_instructor(request.user) or course.has_ta(request.user)
+            or (sub.student == request.user and hasattr(sub, 'autograderresult') and sub.autograderresult.visible)):
+        return JsonResponse({'error': 'access denied'}, status=403)
+    
+    try:
+        offset = max(0, int(request.GET.get('offset', 0)))
+    except ValueError:
+        offset = 0
+    
+    done = not AutogradeJob.objects.filter(result__submission=sub).exclude(state=AutogradeJob.ST_DONE).exists()
+    
+    #Read at most one chunk past the offset
+    data = b''
+    logfile = sub.get_autograde_output_log()
+    if logfile.exists() and logfile.stat().st_size > offset:
+        with open(logfile, 'rb') as f:
+            f.seek(offset)
+            data = f.read(LOG_CHUNK_SIZE)
+    
+    #Hold back a multi-byte character split by the chunk boundary until the next request
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    text = decoder.decode(data)
+    offset += len(data) - len(decoder.getstate()[0])
+    
+    #More may still be unread even if the run has finished
+    done = done and len(data) < LOG_CHUNK_SIZE
+    
+    return JsonResponse({'offset': offset, 'data': text, 'done': done})
+
+
+def artifact_download(request, digest):
+    """
+    Returns the submission or autograder zip with the given sha256 to a remote autograder worker
+    A zip replaced since its job was queued no longer has that hash, so each
+    file is hashed as it is opened and only served if it still matches
+    """
+    if not remote.check_token(request):
+        return HttpResponseForbidden()
+    
+    #Any job with the zip will do, since the hash identifies its contents
+    paths = set(AutogradeJob.objects.filter(autograder_hash=digest).values_list('autograder_zip', flat=True).distinct())
+    paths |= set(AutogradeJob.objects.filter(submission_hash=digest).values_list('submission_zip', flat=True).distinct())
+    for path in paths:
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            continue
+        sha = hashlib.sha256()
+        for chunk in iter(lambda: f.read(autograder_cache.HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+        if sha.hexdigest() == digest:
+            f.seek(0)
+            return FileResponse(f, as_attachment=False, filename=os.path.basename(path))
+        f.close()
+    
+    raise Http404()
+
+
+@csrf_exempt
+@require_POST
+def job_complete(request, jobid):
+    """
+    Receives the results directory, log and status of a job from a remote
+    autograder worker, and completes the job as a local worker would
+    """
+    if not remote.check_token(request):
+        return HttpResponseForbidden()
+    
+    #Checked before the upload is read
+    max_size = settings.AUTOGRADER_PUSH_MAX_SIZE
+    if int(request.META.get('CONTENT_LENGTH') or 0) > max_size:
+        return HttpResponse('Results larger than %d bytes' % max_size, status=413)
+    
+    job = AutogradeJob.objects.select_related('result__submission').filter(id=jobid).first()
+    if not job:
+        raise Http404()
+    sub = job.result.submission
+    
+    #A finished job or an attempt that lost its lease leaves no trace; complete_job
+    #checks again with the job locked
+    status = json.loads(request.POST['status'])
+    if job.state == AutogradeJob.ST_DONE or status['attempt'] != job.attempt:
+        return JsonResponse({'job': job.id})
+    
+    #Unpack the results where a local worker would have left them
+    with ZipFile(request.FILES['results']) as z:
+        if sum(m.file_size for m in z.infolist()) + request.FILES['log'].size > max_size:
+            return HttpResponse('Results larger than %d bytes' % max_size, status=413)
+        staging = grader.tasks.get_staging_dir(job, status['attempt'])
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        z.extractall(staging)
+    
+    with open(sub.get_autograde_output_log(), 'ab') as log:
+        for chunk in request.FILES['log'].chunks():
+            log.write(chunk)
+    
+    grader.tasks.complete_job(job, status)
+    return JsonResponse({'job': job.id})
+
+
 def submission_delete(request, subid, subdir, filename):
     """
     Deletes a suplemental or report file 
@@ -195,7 +327,7 @@ def grades_download(request, courseid):
     
 def reset_autograde(request, gradeid):
     """
-    Removes an autograder result from a user's submission
+    Removes an autograder result from a user's submission and reruns the autograder
     """
     
     #Get the result to remove
@@ -206,13 +338,10 @@ def reset_autograde(request, gradeid):
     if not (course.has_instructor(request.user) or course.has_ta(request.user)):
         return render(request, 'grader/access_denied.html', {'course': course})
         
-    #Update status of submission
+    #Delete the result and queue the submission again, reusing an identical
+    #submission's result unless the assignment always reruns
     sub = grade.submission
-    sub.status = Submission.CH_TO_AUTOGRADE
-    sub.save()
-    
-    #Delete the submission
-    grade.delete()
+    regrade.rerun(sub, force=False)
 
     return HttpResponseRedirect(reverse('grader:submissions', args=(sub.assignment.id,sub.student.id)))
     
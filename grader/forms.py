@@ -1,7 +1,17 @@
 from django.forms import *
 from grader.models import *
 from  django.contrib.auth.forms import AuthenticationForm
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 import grader.tasks
+import grader.scheduler
+import grader.regrade
+
+import base64
+import json
+import stat
+import struct
+import zipfile
 
 
 class AssgnForm(ModelForm):
@@ -12,7 +22,11 @@ class AssgnForm(ModelForm):
         model = Assignment
         fields = ['title', 'code', 'desc', 'desc_format', 'due_date', 
                   'enforce_deadline', 'max_grade', 'max_subs', 
-                  'visible_date', 'autograde_mode', 'autograder_path']
+                  'visible_date', 'autograde_mode', 'autograder_path',
+                  'autograde_force_rerun', 'autograde_cpu_quota',
+                  'autograde_memory_limit', 'autograde_pids_limit',
+                  'autograde_wall_timeout', 'autograde_cpu_timeout',
+                  'sub_max_files', 'sub_max_size', 'sub_max_ratio']
 
     def __init__(self, *args, **kwargs):
         super(AssgnForm, self).__init__(*args, **kwargs)
@@ -38,9 +52,102 @@ class CourseForm(ModelForm):
         bootstrapFormControls(self)
      
 
-def zip_validator(f):
-    pass
-        
+#End of central directory records of a zip, and the zip64 locator and record
+#used when the counts don't fit in the first
+ZIP_END = struct.Struct('<4s4H2LH')
+ZIP_END_SIGNATURE = b'PK\x05\x06'
+ZIP64_LOCATOR = struct.Struct('<4sLQL')
+ZIP64_LOCATOR_SIGNATURE = b'PK\x06\x07'
+ZIP64_END = struct.Struct('<4sQ2H2L4Q')
+ZIP64_END_SIGNATURE = b'PK\x06\x06'
+
+#Most bytes of central directory allowed per file in the file limit, on average
+ZIP_DIRECTORY_BYTES_PER_FILE = 1024
+
+
+def read_zip_end(f):
+    """
+    Returns (number of files, size of the central directory in bytes) of a
+    zip, from the end of central directory record alone
+    Raises ValidationError if the zip has no such record
+    """
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    #The record is followed by a comment of at most 64KB
+    start = max(0, size - ZIP_END.size - 0xFFFF)
+    f.seek(start)
+    tail = f.read()
+
+    pos = tail.rfind(ZIP_END_SIGNATURE)
+    if pos < 0 or len(tail) - pos < ZIP_END.size:
+        raise ValidationError('File is not a valid zip file')
+    count, dir_size = ZIP_END.unpack_from(tail, pos)[4:6]
+
+    if count == 0xFFFF or dir_size == 0xFFFFFFFF:
+        locator = start + pos - ZIP64_LOCATOR.size
+        if locator >= 0:
+            f.seek(locator)
+            signature, disk, end_offset, disks = ZIP64_LOCATOR.unpack(f.read(ZIP64_LOCATOR.size))
+            if signature == ZIP64_LOCATOR_SIGNATURE:
+                f.seek(end_offset)
+                record = f.read(ZIP64_END.size)
+                if len(record) == ZIP64_END.size and record.startswith(ZIP64_END_SIGNATURE):
+                    count, dir_size = ZIP64_END.unpack(record)[7:9]
+
+    return count, dir_size
+
+
+def zip_validator(f, limits):
+    """
+    Checks an uploaded zip against the limits from Assignment.get_zip_limits()
+    Only the zip's central directory is read, so nothing is extracted and a
+    zip bomb is turned away as quickly as any other zip. A zip with too many
+    files is turned away by its end record, before its directory is parsed
+    """
+    try:
+        count, dir_size = read_zip_end(f)
+    finally:
+        f.seek(0)
+
+    if count > limits['max_files']:
+        raise ValidationError('Zip file contains %d files, more than the limit of %d'
+                              % (count, limits['max_files']))
+    #Parsing the directory takes time in proportion to its size, whatever the count says
+    if dir_size > limits['max_files'] * ZIP_DIRECTORY_BYTES_PER_FILE:
+        raise ValidationError('Zip file directory is larger than %d files should need' % limits['max_files'])
+
+    try:
+        with zipfile.ZipFile(f) as z:
+            members = z.infolist()
+    except (zipfile.BadZipFile, OSError):
+        raise ValidationError('File is not a valid zip file')
+    finally:
+        f.seek(0)
+
+    if len(members) > limits['max_files']:
+        raise ValidationError('Zip file contains %d files, more than the limit of %d'
+                              % (len(members), limits['max_files']))
+
+    total = sum(m.file_size for m in members)
+    if total > limits['max_size']:
+        raise ValidationError('Zip file unzips to %.1fMB, more than the limit of %.1fMB'
+                              % (total / 1024**2, limits['max_size'] / 1024**2))
+
+    #Ratio of the whole zip catches members that share compressed data
+    if total > limits['max_ratio'] * max(f.size, 1):
+        raise ValidationError('Zip file is compressed more than %d times' % limits['max_ratio'])
+
+    for m in members:
+        if m.file_size > limits['max_ratio'] * max(m.compress_size, 1):
+            raise ValidationError('%s is compressed more than %d times' % (m.filename, limits['max_ratio']))
+
+        #Unix mode is kept in the top bits; symlinks could point anywhere once unzipped
+        parts = m.filename.replace('\\', '/').split('/')
+        if m.filename.startswith(('/', '\\')) or '..' in parts or ':' in parts[0] \
+                or stat.S_ISLNK(m.external_attr >> 16):
+            raise ValidationError('%s would be unzipped outside the submission directory' % m.filename)
+
+
 class SubmitForm(Form):
     """
     Form for submitting an assignment
@@ -56,6 +163,17 @@ class SubmitForm(Form):
         self.assignment = assignment
         self.user = user
         bootstrapFormControls(self)
+
+    def clean_sub_file(self):
+        """
+        Rejects zips over the assignment's limits before anything is saved or queued
+        Autograded assignments only take zips
+        """
+        f = self.cleaned_data['sub_file']
+        if self.assignment.autograde_mode == Assignment.AUTOGRADE or zipfile.is_zipfile(f):
+            zip_validator(f, self.assignment.get_zip_limits())
+        f.seek(0)
+        return f
     
     def save_submission(self):
         """
@@ -85,6 +203,11 @@ class SubmitForm(Form):
 
         if is_autograde:
             new_sub.status = Submission.CH_TO_AUTOGRADE
+            new_sub.save()
+
+            #Free the workers held by the student's superseded submissions
+            for sub in grader.scheduler.cancel_superseded(new_sub):
+                grader.regrade.item_done(sub)
             grader.tasks.autograde_submission(new_sub, filename)
 
         return new_sub
@@ -142,6 +265,102 @@ class GradeForm(ModelForm):
         
     
         
+class SubmissionFilterForm(Form):
+    """
+    Filters and sorts students' latest submissions for the instructor table
+    Read from the query string of the table's JSON pages, and from the
+    assignment page's form when a bulk action targets the whole filter
+    """
+
+    #Rows per page of the table
+    PAGE_SIZE = 50
+
+    #Columns the table can be sorted on, all indexed
+    SORT_FIELDS = {'date': 'sub_date', 'student': 'student__username'}
+    SORT_CHOICES = (('-date', 'Newest first'), ('date', 'Oldest first'),
+                    ('student', 'Student (A-Z)'), ('-student', 'Student (Z-A)'))
+
+    status = TypedChoiceField(coerce=int, empty_value=None, required=False,
+                              choices=(('', 'Any status'),) + tuple(c for c in Submission.STATUS_CHOICES
+                                                                    if c[0] != Submission.CH_PREVIOUS))
+    graded = ChoiceField(required=False, choices=(('', 'Graded or not'), ('yes', 'Graded'), ('no', 'Not graded')))
+    min_score = FloatField(required=False, label='Min. autograder score')
+    max_score = FloatField(required=False, label='Max. autograder score')
+    sort = ChoiceField(required=False, choices=SORT_CHOICES)
+
+    #Where the previous page ended, see get_page
+    after = CharField(required=False, widget=HiddenInput)
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        bootstrapFormControls(self)
+
+    def clean_after(self):
+        """
+        Decodes the (sort value, submission id) of the last row of the previous page
+        """
+        if not self.cleaned_data['after']:
+            return None
+        try:
+            value, subid = json.loads(base64.urlsafe_b64decode(self.cleaned_data['after']))
+            return value, int(subid)
+        except (ValueError, TypeError):
+            raise ValidationError('Invalid page')
+
+    def get_sort(self):
+        """
+        Returns the sort field and whether it is descending
+        """
+        sort = self.cleaned_data['sort'] or self.SORT_CHOICES[0][0]
+        return self.SORT_FIELDS[sort.lstrip('-')], sort.startswith('-')
+
+    def get_submissions(self, assignment):
+        """
+        Returns the latest submissions of an assignment matching the filter, sorted
+        """
+        subs = Submission.get_latest(assignment).select_related('grade')
+
+        if self.cleaned_data['status'] is not None:
+            subs = subs.filter(status=self.cleaned_data['status'])
+        if self.cleaned_data['graded']:
+            subs = subs.filter(grade__isnull=self.cleaned_data['graded'] == 'no')
+        if self.cleaned_data['min_score'] is not None:
+            subs = subs.filter(autograderresult__score__gte=self.cleaned_data['min_score'])
+        if self.cleaned_data['max_score'] is not None:
+            subs = subs.filter(autograderresult__score__lte=self.cleaned_data['max_score'])
+
+        field, desc = self.get_sort()
+        order = '-' if desc else ''
+        return subs.order_by(order + field, order + 'id')
+
+    def get_page(self, assignment):
+        """
+        Returns (submissions, after) for the page following the row encoded
+        in "after", where after encodes the page's last row, or is None on the
+        last page
+        Pages are found by the last row's sort value rather than an offset, so
+        each page is as cheap as the first
+        """
+        subs = self.get_submissions(assignment)
+        field, desc = self.get_sort()
+
+        if self.cleaned_data['after']:
+            value, subid = self.cleaned_data['after']
+            if field == 'sub_date':
+                value = parse_datetime(value)
+            op = 'lt' if desc else 'gt'
+            subs = subs.filter(Q(**{'%s__%s' % (field, op): value}) | Q(**{field: value, 'id__' + op: subid}))
+
+        subs = list(subs[:self.PAGE_SIZE + 1])
+        if len(subs) <= self.PAGE_SIZE:
+            return subs, None
+
+        subs = subs[:self.PAGE_SIZE]
+        last = subs[-1]
+        value = last.sub_date.isoformat() if field == 'sub_date' else last.student.username
+        return subs, base64.urlsafe_b64encode(json.dumps([value, last.id]).encode()).decode()
+
+
 class LoginForm(AuthenticationForm):
     """
     Login form with bootstrap controls
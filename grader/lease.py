@@ -0,0 +1,152 @@
+"""
+Leases on autograder jobs, so a job runs at most once at a time
+
+django-q redelivers a task whose worker died or took longer than
+Q_CLUSTER['retry'] seconds, while the first run may still be going. Before
+running a job, a worker claims it: the claim starts a new attempt and takes
+a lease that lasts AUTOGRADER_LEASE_TIME seconds, which a Heartbeat thread
+renews while the attempt runs. A task that finds the job finished, or its
+lease held by a live attempt, does nothing.
+
+Each attempt works in its own working directory and leaves its results in
+its own staging directory, which replaces the job's results only when
+complete_job accepts the attempt. An attempt that loses its lease is killed
+and its results are ignored.
+
+reclaim() requeues every job whose lease ran out without it finishing, e.g.
+because the host went down mid-run or django-q replaced a worker it killed
+without running the task's hook. It also requeues jobs that were dispatched
+but never claimed within their task's timeout. It runs when a cluster starts
+and every minute from the cluster's schedule.
+"""
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from datetime import timedelta
+import logging
+import os
+import socket
+import threading
+import time
+
+from grader.models import AutogradeJob
+from grader import scheduler
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_owner():
+    """
+    Returns the name this worker holds leases under
+    """
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def get_expiry():
+    return timezone.now() + timedelta(seconds=settings.AUTOGRADER_LEASE_TIME)
+
+
+def claim(job_id):
+    """
+    Starts a new attempt at a job and takes its lease
+    Returns the job, or None if it is done or another attempt holds the lease
+    """
+    with transaction.atomic():
+        job = (AutogradeJob.objects.select_for_update().select_related('result__submission', 'assignment')
+               .get(id=job_id))
+        if job.state == AutogradeJob.ST_DONE:
+            return None
+        if job.lease_expires and job.lease_expires > timezone.now():
+            logger.warning("Not running %s, attempt %d is still running on %s", job, job.attempt, job.lease_owner)
+            return None
+
+        job.attempt += 1
+        job.lease_owner = get_owner()
+        job.lease_expires = get_expiry()
+        job.state = AutogradeJob.ST_RUNNING
+        job.started_at = timezone.now()
+        job.save(update_fields=['attempt', 'lease_owner', 'lease_expires', 'state', 'started_at'])
+
+    return job
+
+
+def renew(job):
+    """
+    Extends the lease of a job's current attempt
+    Returns False if the attempt no longer holds the lease
+    """
+    return AutogradeJob.objects.filter(id=job.id, attempt=job.attempt, lease_owner=job.lease_owner) \
+                               .exclude(state=AutogradeJob.ST_DONE) \
+                               .update(lease_expires=get_expiry()) > 0
+
+
+class Heartbeat(threading.Thread):
+    """
+    Renews the lease of a job's attempt until stopped, noting if it was lost
+    """
+
+    def __init__(self, job):
+        super().__init__(daemon=True)
+        self.job = job
+        self.stopped = threading.Event()
+        self.lost = threading.Event()
+
+    def run(self):
+        #Claiming the job took the first lease
+        interval = settings.AUTOGRADER_LEASE_TIME / 3
+        held_until = time.monotonic() + (self.job.lease_expires - timezone.now()).total_seconds()
+        try:
+            while not self.stopped.wait(interval):
+                renewed_at = time.monotonic()
+                try:
+                    renewed = renew(self.job)
+                except DatabaseError:
+                    #E.g. the database restarting; a fresh connection may work next time
+                    logger.warning("Could not renew the lease of %s", self.job, exc_info=True)
+                    connection.close()
+                    if time.monotonic() + interval < held_until:
+                        continue
+                    #Stop before the lease runs out and the job is run again elsewhere
+                    renewed = False
+                else:
+                    held_until = renewed_at + settings.AUTOGRADER_LEASE_TIME
+
+                if not renewed:
+                    logger.warning("%s lost the lease of attempt %d", self.job, self.job.attempt)
+                    self.lost.set()
+                    return
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def reclaim():
+    """
+    Requeues jobs whose attempt's lease ran out before the job finished, and
+    jobs no worker claimed within their task's timeout
+    Returns the number of jobs requeued
+    """
+    now = timezone.now()
+    count = (AutogradeJob.objects.filter(state__in=(AutogradeJob.ST_DISPATCHED, AutogradeJob.ST_RUNNING),
+                                         lease_expires__lt=now)
+             .update(state=AutogradeJob.ST_PENDING, task_id='', lease_owner='', lease_expires=None))
+
+    #Never claimed, so there is no lease to run out
+    for job in (AutogradeJob.objects.filter(state=AutogradeJob.ST_DISPATCHED, lease_expires__isnull=True,
+                                            dispatched_at__isnull=False)
+                .select_related('assignment')):
+        expiry = job.dispatched_at + timedelta(seconds=scheduler.get_timeout(job) + settings.AUTOGRADER_LEASE_TIME)
+        if expiry < now:
+            count += (AutogradeJob.objects.filter(id=job.id, state=AutogradeJob.ST_DISPATCHED,
+                                                  lease_expires__isnull=True, dispatched_at=job.dispatched_at)
+                      .update(state=AutogradeJob.ST_PENDING, task_id=''))
+
+    if count:
+        logger.warning("Requeued %d autograder job(s) left behind by dead workers", count)
+        scheduler.dispatch()
+    return count
@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.utils import timezone
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from grader import autoscale, scheduler
+
+
+class Command(BaseCommand):
+    help = 'Runs autograder qclusters, sizing the worker pool from the queue, host load and upcoming due dates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=settings.AUTOSCALE_INTERVAL,
+                            help='Seconds between scaling decisions')
+
+    def handle(self, *args, **options):
+        self.clusters = list()
+        self.stopping = list()
+        last_grown = None
+
+        #Stop cleanly on SIGTERM as well as Ctrl-C
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        try:
+            while True:
+                self.reap()
+                current = len(self.clusters) * settings.AUTOSCALE_CLUSTER_WORKERS
+                workers, decision = autoscale.get_target(current, last_grown)
+
+                if workers > current:
+                    while len(self.clusters) * settings.AUTOSCALE_CLUSTER_WORKERS < workers:
+                        self.start_cluster()
+                    last_grown = timezone.now()
+                    autoscale.record(decision)
+                    #Hand the new workers whatever is waiting
+                    scheduler.dispatch()
+
+                elif workers < current:
+                    #Lower the scheduler's capacity before stopping workers, so
+                    #nothing new is sent their way; running jobs still finish
+                    autoscale.record(decision)
+                    while len(self.clusters) * settings.AUTOSCALE_CLUSTER_WORKERS > workers:
+                        self.stop_cluster()
+
+                time.sleep(options['interval'])
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            autoscale.record_stopped(len(self.clusters) * settings.AUTOSCALE_CLUSTER_WORKERS)
+            while self.clusters:
+                self.stop_cluster()
+            for proc in self.stopping:
+                proc.wait()
+
+    def start_cluster(self):
+        env = dict(os.environ, ATHENA_QCLUSTER_WORKERS=str(settings.AUTOSCALE_CLUSTER_WORKERS))
+        proc = subprocess.Popen([sys.executable, str(settings.BASE_DIR / 'manage.py'), 'qcluster'], env=env)
+        self.clusters.append(proc)
+        self.stdout.write('Started qcluster %d' % proc.pid)
+
+    def stop_cluster(self):
+        #A stopping qcluster finishes the tasks it has already taken
+        proc = self.clusters.pop()
+        proc.send_signal(signal.SIGTERM)
+        self.stopping.append(proc)
+        self.stdout.write('Stopping qcluster %d' % proc.pid)
+
+    def reap(self):
+        """
+        Forgets qclusters that have exited, so any that died unexpectedly get replaced
+        """
+        for proc in [p for p in self.clusters if p.poll() is not None]:
+            self.stderr.write('qcluster %d exited with %d' % (proc.pid, proc.returncode))
+            self.clusters.remove(proc)
+        self.stopping = [p for p in self.stopping if p.poll() is None]
@@ -0,0 +1,130 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile
+import io
+import os
+import shutil
+import time
+import uuid
+
+from grader.models import Course, Assignment, Submission, AutogradeJob
+from grader.forms import SubmitForm
+from grader.metrics import percentile
+
+
+#Fake run_autograder scripts, filled in with the number of seconds to take
+RUN_AUTOGRADER = {
+    'sleep': 'sleep %(seconds)s',
+    'cpu': "timeout %(seconds)s sh -c 'while :; do :; done' || true",
+}
+
+RESULTS = '{"score": 1, "tests": [{"name": "benchmark", "score": 1, "max_score": 1}]}'
+
+
+class Command(BaseCommand):
+    help = ('Measures autograding throughput and turnaround by pushing submissions to a throwaway '
+            'assignment with a fake autograder through the full pipeline; needs a running qcluster')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--submissions', type=int, default=50,
+                            help='Number of submissions, each from a different student')
+        parser.add_argument('-c', '--concurrency', type=int, default=10,
+                            help='Number of submissions made at once')
+        parser.add_argument('--mode', choices=sorted(RUN_AUTOGRADER), default='sleep',
+                            help='Whether the fake autograder sleeps or burns CPU')
+        parser.add_argument('--seconds', type=float, default=1,
+                            help='Seconds each run of the fake autograder takes')
+        parser.add_argument('--timeout', type=int, default=1800,
+                            help='Seconds to wait for every submission to be graded')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the benchmark course, students and submissions afterwards')
+
+    def handle(self, *args, **options):
+        if settings.Q_CLUSTER.get('sync'):
+            self.stderr.write('Q_CLUSTER runs tasks synchronously, so runs happen one at a time in this process')
+
+        run = uuid.uuid4().hex[:6]
+        self.autograder = os.path.join(settings.TEMP_DIR, 'benchmark-%s.zip' % run)
+        self.write_autograder(options['mode'], options['seconds'])
+
+        #Throwaway course with no semester, so it doesn't show up anywhere
+        self.course = Course.objects.create(code='BENCH', section=0, title='Autograder benchmark %s' % run)
+        self.assgn = Assignment.objects.create(
+            course=self.course, code='bench-%s' % run, title='Autograder benchmark', due_date=timezone.now(),
+            autograde_mode=Assignment.AUTOGRADE, autograder_path=self.autograder, autograde_force_rerun=True)
+        User.objects.bulk_create([User(username='bench-%s-%d' % (run, i)) for i in range(options['submissions'])])
+        self.students = list(User.objects.filter(username__startswith='bench-%s-' % run))
+        self.course.students.add(*self.students)
+
+        try:
+            self.benchmark(run, options)
+        finally:
+            if not options['keep']:
+                self.clean_up()
+
+    def benchmark(self, run, options):
+        def submit(student):
+            try:
+                #Different contents for every student, so no run is reused
+                upload = io.BytesIO()
+                with ZipFile(upload, 'w') as z:
+                    z.writestr('submission.txt', '%s %s' % (run, student.username))
+                form = SubmitForm(self.assgn, student, {},
+                                  {'sub_file': SimpleUploadedFile('submission.zip', upload.getvalue())})
+                if not form.is_valid():
+                    raise CommandError('Benchmark submission rejected: %s' % form.errors)
+                form.save_submission()
+            finally:
+                connection.close()
+
+        self.stdout.write('Submitting %d submissions, %d at a time, to a %s %gs autograder'
+                          % (len(self.students), options['concurrency'], options['mode'], options['seconds']))
+        start = time.time()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            list(pool.map(submit, self.students))
+        self.stdout.write('Submitted in %.2fs' % (time.time() - start))
+
+        subs = Submission.objects.filter(assignment=self.assgn)
+        while subs.filter(status=Submission.CH_TO_AUTOGRADE).exists():
+            if time.time() - start > options['timeout']:
+                raise CommandError('%d of %d submissions still waiting after %ds'
+                                   % (subs.filter(status=Submission.CH_TO_AUTOGRADE).count(),
+                                      len(self.students), options['timeout']))
+            time.sleep(0.5)
+
+        #A submission is done when its last job (shard) finishes
+        submitted = dict()
+        finished = dict()
+        for subid, sub_date, finished_at in (AutogradeJob.objects.filter(assignment=self.assgn)
+                                             .values_list('result__submission', 'result__submission__sub_date',
+                                                          'finished_at')):
+            submitted[subid] = sub_date
+            finished[subid] = max(finished_at, finished.get(subid, finished_at))
+
+        turnaround = sorted((finished[s] - submitted[s]).total_seconds() for s in finished)
+        elapsed = (max(finished.values()) - min(submitted.values())).total_seconds()
+        failed = subs.filter(autograderresult__autograde_success=False).count()
+
+        self.stdout.write('Graded %d submissions in %.2fs: %.1f per minute, %d failed'
+                          % (len(turnaround), elapsed, len(turnaround) * 60 / max(elapsed, 0.001), failed))
+        self.stdout.write('Turnaround: p50 %.2fs, p95 %.2fs, p99 %.2fs, max %.2fs'
+                          % (percentile(turnaround, 50), percentile(turnaround, 95),
+                             percentile(turnaround, 99), turnaround[-1]))
+
+    def write_autograder(self, mode, seconds):
+        os.makedirs(os.path.dirname(self.autograder), exist_ok=True)
+        with ZipFile(self.autograder, 'w') as z:
+            script = '#!/usr/bin/env bash\n%s\necho \'%s\' > results/results.json\n' % (
+                RUN_AUTOGRADER[mode] % {'seconds': seconds}, RESULTS)
+            z.writestr('run_autograder', script)
+
+    def clean_up(self):
+        shutil.rmtree(settings.SUBMISSION_DIR / str(self.assgn.id), ignore_errors=True)
+        self.course.delete()
+        User.objects.filter(id__in=[s.id for s in self.students]).delete()
+        os.remove(self.autograder)
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+from grader.models import Assignment
+from grader import regrade
+
+
+class Command(BaseCommand):
+    help = 'Reruns the autograder on every current submission for an assignment'
+
+    def add_arguments(self, parser):
+        parser.add_argument('assgnid', type=int, help='ID of the assignment to regrade')
+        parser.add_argument('--wait', action='store_true',
+                            help='Wait for the regrade to finish and print the score changes')
+        parser.add_argument('--interval', type=int, default=10,
+                            help='Seconds between progress updates while waiting')
+
+    def handle(self, *args, **options):
+        try:
+            assgn = Assignment.objects.get(id=options['assgnid'])
+        except Assignment.DoesNotExist:
+            raise CommandError('Assignment %d does not exist' % options['assgnid'])
+
+        batch = regrade.start(assgn)
+        self.print_progress(batch)
+
+        if not options['wait']:
+            return
+
+        while not batch.finished:
+            time.sleep(options['interval'])
+            batch.refresh_from_db()
+            self.print_progress(batch)
+
+        #Print the score changes once every run has finished
+        changed = 0
+        for item in batch.regradeitem_set.select_related('submission__student').order_by('submission__student__username'):
+            if item.old_score != item.new_score:
+                changed += 1
+                self.stdout.write('%-20s %8s -> %8s' % (item.submission.student.username, item.old_score, item.new_score))
+        self.stdout.write('%d score(s) changed' % changed)
+
+    def print_progress(self, batch):
+        counts = batch.get_counts()
+        self.stdout.write('%s: %d of %d regraded, %d queued' % (batch, counts['done'], counts['total'], counts['queued']))
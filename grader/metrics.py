@@ -0,0 +1,171 @@
+"""
+Per-phase timing of autograder runs
+
+autograde.sh writes a "phase <name> <microseconds>" line to a timings file
+as each of its phases ends, and the time from queueing a job to a worker picking it
+up is taken from the AutogradeJob. Every phase of every run is stored as an
+AutograderTiming, which backs the timing pages and the plain-text metrics
+endpoint for Prometheus.
+"""
+
+from django.conf import settings
+from django.utils import timezone
+from collections import Counter
+from datetime import timedelta
+import hmac
+
+from grader.models import AutograderTiming, AutogradeJob
+from grader import scheduler
+
+
+#Prefix of the phase timing lines printed by autograde.sh
+PHASE_PREFIX = 'phase '
+
+#Percentiles shown for each phase
+PERCENTILES = (50, 90, 99)
+
+#Only runs this recent are included in the statistics
+STATS_WINDOW = timedelta(days=30)
+
+
+def check_token(request):
+    """
+    Returns whether a request to the metrics endpoint carries METRICS_TOKEN
+    """
+    token = settings.METRICS_TOKEN
+    given = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and hmac.compare_digest(given, 'Bearer ' + token)
+
+
+def parse_phases(text):
+    """
+    Returns list of (phase, seconds) from the timings written by autograde.sh
+    Ignores unknown phases and anything that isn't a phase timing line
+    """
+    phases = dict(AutograderTiming.PHASE_CHOICES)
+    timings = list()
+    for line in (text or '').splitlines():
+        if not line.startswith(PHASE_PREFIX):
+            continue
+        try:
+            name, usec = line[len(PHASE_PREFIX):].split()
+            if name in phases:
+                timings.append((name, int(usec) / 1000000))
+        except ValueError:
+            continue
+
+    return timings
+
+
+def record(job, phases):
+    """
+    Stores the queue wait of a job and the (phase, seconds) timings of its run
+    """
+    timings = list(phases or [])
+    wait = job.get_queue_wait()
+    if wait is not None:
+        timings.insert(0, ('queue', wait.total_seconds()))
+
+    AutograderTiming.objects.bulk_create([
+        AutograderTiming(result_id=job.result_id, assignment_id=job.assignment_id,
+                         shard_index=job.shard_index, phase=phase, seconds=seconds)
+        for phase, seconds in timings])
+
+
+def percentile(values, p):
+    """
+    Returns the p-th percentile of a sorted list, interpolating between values
+    """
+    if not values:
+        return None
+    rank = (len(values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def get_phase_stats(timings=None):
+    """
+    Returns list of dicts with the count, mean, maximum and percentiles of each
+    phase over the last STATS_WINDOW, in the order phases happen
+    timings may be a queryset of AutograderTimings to restrict the statistics to
+    """
+    if timings is None:
+        timings = AutograderTiming.objects.all()
+
+    values = {phase: list() for phase, label in AutograderTiming.PHASE_CHOICES}
+    rows = (timings.filter(created__gte=timezone.now() - STATS_WINDOW)
+            .order_by('seconds').values_list('phase', 'seconds'))
+    for phase, seconds in rows:
+        if phase in values:
+            values[phase].append(seconds)
+
+    stats = list()
+    for phase, label in AutograderTiming.PHASE_CHOICES:
+        v = values[phase]
+        stats.append({
+            'phase': phase,
+            'label': label,
+            'count': len(v),
+            'sum': sum(v),
+            'mean': sum(v) / len(v) if v else None,
+            'max': v[-1] if v else None,
+            'percentiles': [(p, percentile(v, p)) for p in PERCENTILES],
+        })
+
+    return stats
+
+
+def get_deps_stats(jobs=None):
+    """
+    Returns dict with the number of runs over the last STATS_WINDOW that found
+    their autograder's dependency cache built (hit) and that had to build it (miss)
+    jobs may be a queryset of AutogradeJobs to restrict the statistics to
+    """
+    if jobs is None:
+        jobs = AutogradeJob.objects.all()
+
+    counts = Counter(jobs.filter(finished_at__gte=timezone.now() - STATS_WINDOW)
+                     .exclude(deps_cache='').values_list('deps_cache', flat=True))
+    return {'hit': counts[AutogradeJob.DEPS_HIT], 'miss': counts[AutogradeJob.DEPS_MISS]}
+
+
+def render_prometheus():
+    """
+    Returns the autograder metrics in the Prometheus text exposition format
+    """
+    lines = [
+        '# HELP athena_autograder_phase_seconds Time taken by each phase of an autograder run over the last %d days' % STATS_WINDOW.days,
+        '# TYPE athena_autograder_phase_seconds summary',
+    ]
+    for s in get_phase_stats():
+        for p, value in s['percentiles']:
+            if value is not None:
+                lines.append('athena_autograder_phase_seconds{phase="%s",quantile="%s"} %f' % (s['phase'], p / 100, value))
+        lines.append('athena_autograder_phase_seconds_sum{phase="%s"} %f' % (s['phase'], s['sum']))
+        lines.append('athena_autograder_phase_seconds_count{phase="%s"} %d' % (s['phase'], s['count']))
+
+    lines += [
+        '# HELP athena_autograder_jobs Autograder jobs not yet finished, by state',
+        '# TYPE athena_autograder_jobs gauge',
+    ]
+    counts = Counter(AutogradeJob.objects.exclude(state=AutogradeJob.ST_DONE).values_list('state', flat=True))
+    for state, label in AutogradeJob.STATE_CHOICES:
+        if state != AutogradeJob.ST_DONE:
+            lines.append('athena_autograder_jobs{state="%s"} %d' % (label.lower(), counts[state]))
+
+    deps = get_deps_stats()
+    lines += [
+        '# HELP athena_autograder_deps_cache_runs Runs that found (hit) or had to build (miss) their dependency cache over the last %d days' % STATS_WINDOW.days,
+        '# TYPE athena_autograder_deps_cache_runs gauge',
+        'athena_autograder_deps_cache_runs{outcome="hit"} %d' % deps['hit'],
+        'athena_autograder_deps_cache_runs{outcome="miss"} %d' % deps['miss'],
+    ]
+
+    lines += [
+        '# HELP athena_autograder_slots Autograder jobs that may run at once',
+        '# TYPE athena_autograder_slots gauge',
+        'athena_autograder_slots %d' % scheduler.get_capacity(),
+    ]
+
+    return '\n'.join(lines) + '\n'
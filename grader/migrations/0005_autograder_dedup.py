@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0004_auto_20210601_0414'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='autograde_force_rerun',
+            field=models.BooleanField(default=False, verbose_name='always rerun autograder'),
+        ),
+        migrations.AddField(
+            model_name='autograderresult',
+            name='input_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0005_autograder_dedup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='autograde_weight',
+            field=models.FloatField(default=1, verbose_name='autograder share'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='reserved_workers',
+            field=models.IntegerField(default=0, verbose_name='reserved autograder workers'),
+        ),
+        migrations.CreateModel(
+            name='AutogradeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('submission_zip', models.TextField()),
+                ('autograder_zip', models.TextField()),
+                ('state', models.IntegerField(choices=[(0, 'Pending'), (1, 'Dispatched'), (2, 'Running'), (3, 'Done')], db_index=True, default=0)),
+                ('task_id', models.CharField(blank=True, max_length=32)),
+                ('enqueued_at', models.DateTimeField(auto_now_add=True)),
+                ('dispatched_at', models.DateTimeField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('assignment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='grader.assignment')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='grader.course')),
+                ('result', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='grader.autograderresult')),
+            ],
+        ),
+    ]
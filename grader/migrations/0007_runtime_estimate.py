@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0006_autograde_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='autogradejob',
+            name='autograder_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='autograderresult',
+            name='run_time',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='RuntimeEstimate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('autograder_hash', models.CharField(max_length=64)),
+                ('seconds', models.FloatField()),
+                ('samples', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('assignment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='grader.assignment')),
+            ],
+            options={
+                'unique_together': {('assignment', 'autograder_hash')},
+            },
+        ),
+    ]
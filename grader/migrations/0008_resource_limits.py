@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0007_runtime_estimate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='autograde_cpu_quota',
+            field=models.FloatField(default=1, verbose_name='autograder CPU cores'),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='autograde_cpu_timeout',
+            field=models.IntegerField(default=900, verbose_name='autograder CPU time limit (seconds)'),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='autograde_memory_limit',
+            field=models.IntegerField(default=1024, verbose_name='autograder memory limit (MB)'),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='autograde_pids_limit',
+            field=models.IntegerField(default=256, verbose_name='autograder process limit'),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='autograde_wall_timeout',
+            field=models.IntegerField(default=900, verbose_name='autograder time limit (seconds)'),
+        ),
+        migrations.AddField(
+            model_name='autograderresult',
+            name='killed_by',
+            field=models.CharField(blank=True, choices=[('', 'Not killed'), ('wall', 'Time limit'), ('cpu', 'CPU time limit'), ('memory', 'Memory limit'), ('pids', 'Process limit')], default='', max_length=10),
+        ),
+    ]
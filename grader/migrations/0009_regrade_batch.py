@@ -0,0 +1,46 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('grader', '0008_resource_limits'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegradeBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RegradeItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('old_score', models.FloatField(blank=True, null=True)),
+                ('new_score', models.FloatField(blank=True, null=True)),
+                ('queued', models.BooleanField(default=False)),
+                ('done', models.BooleanField(default=False)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='grader.regradebatch')),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='grader.submission')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='regradebatch',
+            name='assignment',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='grader.assignment'),
+        ),
+        migrations.AddField(
+            model_name='regradebatch',
+            name='started_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
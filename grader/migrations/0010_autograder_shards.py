@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0009_regrade_batch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='autogradejob',
+            name='killed_by',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='autogradejob',
+            name='returncode',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='autogradejob',
+            name='shard_count',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='autogradejob',
+            name='shard_index',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='autogradejob',
+            name='result',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='grader.autograderresult'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0010_autograder_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AutograderTiming',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard_index', models.IntegerField(default=0)),
+                ('phase', models.CharField(choices=[('queue', 'Queue wait'), ('autograder', 'Autograder setup'), ('submission', 'Submission unzip'), ('run', 'run_autograder'), ('results', 'Results copy')], max_length=16)),
+                ('seconds', models.FloatField()),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('assignment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='grader.assignment')),
+                ('result', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='grader.autograderresult')),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:47
+
+from django.db import migrations, models
+
+
+def add_collector_schedule(apps, schema_editor):
+    """
+    Schedules grader.workspace.collect to run every few minutes on the cluster
+    """
+    Schedule = apps.get_model('django_q', 'Schedule')
+    Schedule.objects.update_or_create(
+        name='collect-workspaces',
+        defaults={'func': 'grader.workspace.collect', 'schedule_type': 'I', 'minutes': 5, 'repeats': -1})
+
+
+def remove_collector_schedule(apps, schema_editor):
+    Schedule = apps.get_model('django_q', 'Schedule')
+    Schedule.objects.filter(name='collect-workspaces').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0011_autograder_timing'),
+        ('django_q', '0014_schedule_cluster'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='autogradertiming',
+            name='phase',
+            field=models.CharField(choices=[('queue', 'Queue wait'), ('autograder', 'Autograder setup'), ('submission', 'Submission unzip'), ('run', 'run_autograder'), ('results', 'Results harvest')], max_length=16),
+        ),
+        migrations.RunPython(add_collector_schedule, remove_collector_schedule),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0012_workspace_collector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='autogradejob',
+            name='deps_cache',
+            field=models.CharField(blank=True, choices=[('', 'No dependency cache'), ('hit', 'Hit'), ('miss', 'Miss')], default='', max_length=4),
+        ),
+        migrations.AlterField(
+            model_name='autogradertiming',
+            name='phase',
+            field=models.CharField(choices=[('queue', 'Queue wait'), ('deps', 'Dependency build'), ('autograder', 'Autograder setup'), ('submission', 'Submission unzip'), ('run', 'run_autograder'), ('results', 'Results harvest')], max_length=16),
+        ),
+    ]
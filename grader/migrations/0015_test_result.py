@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0014_dependency_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.IntegerField()),
+                ('name', models.CharField(blank=True, max_length=255)),
+                ('score', models.FloatField(blank=True, null=True)),
+                ('max_score', models.FloatField(blank=True, null=True)),
+                ('passed', models.BooleanField(blank=True, null=True)),
+                ('output', models.TextField(blank=True)),
+                ('assignment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='grader.assignment')),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='grader.autograderresult')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='testresult',
+            index=models.Index(fields=['assignment', 'name'], name='grader_test_assignm_bc5e63_idx'),
+        ),
+    ]
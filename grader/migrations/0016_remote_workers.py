@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0015_test_result'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='autogradejob',
+            name='submission_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='autogradejob',
+            name='autograder_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
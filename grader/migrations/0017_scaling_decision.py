@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0016_remote_workers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScalingDecision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('workers', models.IntegerField(blank=True, null=True)),
+                ('previous', models.IntegerField(default=0)),
+                ('queued', models.IntegerField(default=0)),
+                ('running', models.IntegerField(default=0)),
+                ('predicted', models.IntegerField(default=0)),
+                ('load', models.FloatField(default=0)),
+                ('reason', models.CharField(blank=True, max_length=200)),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
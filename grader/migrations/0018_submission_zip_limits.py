@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0017_scaling_decision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='sub_max_files',
+            field=models.IntegerField(default=1000, verbose_name='submission file limit'),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='sub_max_ratio',
+            field=models.IntegerField(default=100, verbose_name='submission compression ratio limit'),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='sub_max_size',
+            field=models.IntegerField(default=100, verbose_name='submission unzipped size limit (MB)'),
+        ),
+    ]
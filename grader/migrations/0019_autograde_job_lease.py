@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0018_submission_zip_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='autogradejob',
+            name='attempt',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='autogradejob',
+            name='lease_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='autogradejob',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=128),
+        ),
+    ]
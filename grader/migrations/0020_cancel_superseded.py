@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0019_autograde_job_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='autograderresult',
+            name='cancelled',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0020_cancel_superseded'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['assignment', 'student', 'sub_date'], name='grader_subm_assignm_6d0394_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['status'], name='grader_subm_status_40beb2_idx'),
+        ),
+    ]
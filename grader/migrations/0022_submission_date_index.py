@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0021_submission_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['sub_date', 'id'], name='grader_subm_sub_dat_2ee97f_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def add_reclaim_schedule(apps, schema_editor):
+    """
+    Schedules grader.lease.reclaim to run every minute on the cluster
+    """
+    Schedule = apps.get_model('django_q', 'Schedule')
+    Schedule.objects.update_or_create(
+        name='reclaim-leases',
+        defaults={'func': 'grader.lease.reclaim', 'schedule_type': 'I', 'minutes': 1, 'repeats': -1})
+
+
+def remove_reclaim_schedule(apps, schema_editor):
+    Schedule = apps.get_model('django_q', 'Schedule')
+    Schedule.objects.filter(name='reclaim-leases').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grader', '0022_submission_date_index'),
+        ('django_q', '0014_schedule_cluster'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_reclaim_schedule, remove_reclaim_schedule),
+    ]
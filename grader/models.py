@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, connection, transaction
 from django.contrib.auth.models import User
 from datetime import datetime
 from django.conf import settings
@@ -9,6 +9,8 @@ import markdown
 import html
 import csv
 
+from grader import roles
+
 
 TEXT_FORMAT = 0
 MARKDOWN_FORMAT = 1
@@ -106,6 +108,12 @@ class Course(models.Model):
     students = models.ManyToManyField(User, blank=True, related_name='students')
     instructors = models.ManyToManyField(User, related_name='instructors')
     tas = models.ManyToManyField(User, blank=True, related_name='tas')
+
+    #Relative share of autograder workers this course gets when courses compete for them
+    autograde_weight = models.FloatField(default=1, verbose_name='autograder share')
+
+    #Number of autograder workers kept free for this course's jobs
+    reserved_workers = models.IntegerField(default=0, verbose_name='reserved autograder workers')
     
     #######################
     # End of model fields #
@@ -120,21 +128,21 @@ class Course(models.Model):
         """
         Returns true if course has student
         """
-        return (user.is_superuser and allow_superusers) or len(self.students.filter(id=user.id)) > 0
+        return (user.is_superuser and allow_superusers) or self.id in roles.get_roles(user)['students']
     
         
     def has_instructor(self, user, allow_superusers=True):
         """
         Returns true if course has instructor
         """
-        return (user.is_superuser and allow_superusers) or len(self.instructors.filter(id=user.id)) > 0
+        return (user.is_superuser and allow_superusers) or self.id in roles.get_roles(user)['instructors']
     
         
     def has_ta(self, user, allow_superusers=True):
         """
         Returns true if course has TA
         """
-        return (user.is_superuser and allow_superusers) or len(self.tas.filter(id=user.id)) > 0
+        return (user.is_superuser and allow_superusers) or self.id in roles.get_roles(user)['tas']
     
         
     def has_user(self, user, allow_superusers=True):
@@ -309,6 +317,22 @@ class Assignment(models.Model):
         blank=True, null=False, default='', verbose_name='autograder zip path',
         match=r'.*\.zip', path=settings.AUTOGRADER_DIR.as_posix(),
         recursive=True, allow_folders=False, allow_files=True)
+
+    # If true, every submission is run through the autograder even if an
+    # identical submission was already autograded with the same autograder
+    autograde_force_rerun = models.BooleanField(default=False, verbose_name='always rerun autograder')
+
+    # Resource limits for each autograder run, see grader/sandbox.py
+    autograde_cpu_quota = models.FloatField(default=1, verbose_name='autograder CPU cores')
+    autograde_memory_limit = models.IntegerField(default=1024, verbose_name='autograder memory limit (MB)')
+    autograde_pids_limit = models.IntegerField(default=256, verbose_name='autograder process limit')
+    autograde_wall_timeout = models.IntegerField(default=900, verbose_name='autograder time limit (seconds)')
+    autograde_cpu_timeout = models.IntegerField(default=900, verbose_name='autograder CPU time limit (seconds)')
+
+    # Limits on submission zips, checked against the zip's directory on upload
+    sub_max_files = models.IntegerField(default=1000, verbose_name='submission file limit')
+    sub_max_size = models.IntegerField(default=100, verbose_name='submission unzipped size limit (MB)')
+    sub_max_ratio = models.IntegerField(default=100, verbose_name='submission compression ratio limit')
     
     #######################
     # End of model fields #
@@ -386,6 +410,42 @@ class Assignment(models.Model):
                             "Sec.%d" % self.course.section,
                             self.code)
         return path.replace(" ", "_")
+
+
+    def get_limits(self):
+        """
+        Returns the resource limits for an autograder run as a dict
+        """
+        return {'cpu_quota': self.autograde_cpu_quota,
+                'memory_limit': self.autograde_memory_limit,
+                'pids_limit': self.autograde_pids_limit,
+                'wall_timeout': self.autograde_wall_timeout,
+                'cpu_timeout': self.autograde_cpu_timeout}
+
+
+    def get_zip_limits(self):
+        """
+        Returns the limits on submission zips as a dict
+        """
+        return {'max_files': self.sub_max_files,
+                'max_size': self.sub_max_size * 1024 * 1024,
+                'max_ratio': self.sub_max_ratio}
+
+
+    def get_test_stats(self):
+        """
+        Returns how each autograder test fared across students' current submissions,
+        as dicts with the test name, number of runs, passes and average score,
+        most often failed first
+        """
+        return (TestResult.objects.filter(assignment=self)
+                .exclude(result__submission__status=Submission.CH_PREVIOUS)
+                .values('name')
+                .annotate(runs=models.Count('id'),
+                          passed=models.Count('id', filter=models.Q(passed=True)),
+                          avg_score=models.Avg('score'),
+                          max_score=models.Max('max_score'))
+                .order_by(models.F('passed') * 1.0 / models.F('runs'), 'name'))
     
     
     def make_submissions_zip(self, subids, incl_subs=True, incl_reports=False, additional_files=None):
@@ -464,6 +524,7 @@ class Submission(models.Model):
     #SUBMISSION_DIR specified in settings.py
     REPORT_DIR = "report"
     SUPLEMENT_DIR = "suplements"
+    SHARD_DIR = "shards"
     RESULTS_FILENAME = 'results.json'
     
     #########################
@@ -486,6 +547,32 @@ class Submission(models.Model):
     # End of model fields #
     #######################
     
+    #Latest submission lookups walk (assignment, student, sub_date); current
+    #submissions are found by excluding previous ones by status, and the
+    #instructor table pages through them by date
+    class Meta:
+        indexes = [models.Index(fields=['assignment', 'student', 'sub_date']),
+                   models.Index(fields=['status']),
+                   models.Index(fields=['sub_date', 'id'])]
+    
+    
+    @staticmethod
+    def get_latest(assignment):
+        """
+        Returns each student's most recent submission to an assignment, newest
+        first, with the student and autograder result joined in
+        """
+        subs = Submission.objects.filter(assignment=assignment)
+        if connection.features.can_distinct_on_fields:
+            latest = subs.order_by('student', '-sub_date', '-id').distinct('student').values('id')
+        else:
+            latest = subs.filter(id=models.Subquery(
+                Submission.objects.filter(assignment=models.OuterRef('assignment'), student=models.OuterRef('student'))
+                .order_by('-sub_date', '-id').values('id')[:1])).values('id')
+        
+        return (Submission.objects.filter(id__in=latest).select_related('student', 'autograderresult')
+                .order_by('-sub_date'))
+    
     
     def get_status_instructor():
         """
@@ -659,6 +746,15 @@ class AutograderResult(models.Model):
     """
     Stores a result from the autograder
     """
+
+    # Limits that can stop an autograder run
+    KILLED_CHOICES = (
+        ('', 'Not killed'),
+        ('wall', 'Time limit'),
+        ('cpu', 'CPU time limit'),
+        ('memory', 'Memory limit'),
+        ('pids', 'Process limit'),
+    )
     
     #########################
     # Start of model fields #
@@ -685,6 +781,19 @@ class AutograderResult(models.Model):
     # Represents if autograder completed successfully
     # Failure defined as non-zero exit code
     autograde_success = models.BooleanField()
+
+    # Hash of the submission zip together with the autograder zip
+    # Runs with the same hash are expected to produce the same result
+    input_hash = models.CharField(max_length=64, blank=True, db_index=True)
+
+    # Wall time of the autograder run in seconds, from worker start to completion
+    run_time = models.FloatField(blank=True, null=True)
+
+    # Resource limit that killed the run, if any
+    killed_by = models.CharField(max_length=10, choices=KILLED_CHOICES, blank=True, default='')
+
+    # Time the run was cancelled because the student submitted again, if it was
+    cancelled = models.DateTimeField(blank=True, null=True)
     
     #######################
     # End of model fields #
@@ -698,8 +807,403 @@ class AutograderResult(models.Model):
         Returns string specifying submission and when it was graded
         """
         return "%s (autograded %s)" % (self.submission, self.date)
+
+
+class TestResult(models.Model):
+    """
+    Stores the result of one test from the "tests" array of an autograder's results.json
+    """
+
+    #Longest test output kept, in characters
+    OUTPUT_MAX_LENGTH = 10000
+
+    #########################
+    # Start of model fields #
+    #########################
+
+    #Result the test is part of, and its assignment for queries across an assignment
+    result = models.ForeignKey('AutograderResult', on_delete=models.CASCADE)
+    assignment = models.ForeignKey('Assignment', on_delete=models.CASCADE)
+
+    #Position of the test in results.json
+    number = models.IntegerField()
+
+    name = models.CharField(max_length=255, blank=True)
+    score = models.FloatField(blank=True, null=True)
+    max_score = models.FloatField(blank=True, null=True)
+
+    #Whether the test passed (none if results.json doesn't say and it has no max score)
+    passed = models.BooleanField(blank=True, null=True)
+
+    #Test output, truncated to OUTPUT_MAX_LENGTH
+    output = models.TextField(blank=True)
+
+    #######################
+    # End of model fields #
+    #######################
+
+    class Meta:
+        indexes = [models.Index(fields=['assignment', 'name'])]
+
+    @staticmethod
+    def from_results(ag_res, results):
+        """
+        Yields unsaved TestResults for the "tests" array of a results.json
+        Tests that aren't JSON objects are skipped
+        """
+        for i, test in enumerate(results.get('tests') or []):
+            if not isinstance(test, dict):
+                continue
+            score = _to_float(test.get('score'))
+            max_score = _to_float(test.get('max_score'))
+
+            #Gradescope's optional status wins over comparing scores
+            if test.get('status') in ('passed', 'failed'):
+                passed = test['status'] == 'passed'
+            elif score is not None and max_score is not None:
+                passed = score >= max_score
+            else:
+                passed = None
+
+            yield TestResult(result=ag_res, assignment_id=ag_res.submission.assignment_id, number=i,
+                             name=str(test.get('name') or test.get('number') or '')[:255],
+                             score=score, max_score=max_score, passed=passed,
+                             output=str(test.get('output') or '')[:TestResult.OUTPUT_MAX_LENGTH])
+
+    def __str__(self):
+        """
+        Returns string specifying the result and test
+        """
+        return "%s: %s" % (self.result, self.name)
+
+
+def _to_float(value):
+    """
+    Returns value as a float, or None if it isn't a number
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class AutogradeJob(models.Model):
+    """
+    Stores an autograder run waiting for or holding an autograder worker
+    Jobs are handed to the task queue by grader.scheduler, which shares the
+    workers fairly between courses and assignments
+    """
+
+    #States of a job
+    ST_PENDING = 0
+    ST_DISPATCHED = 1
+    ST_RUNNING = 2
+    ST_DONE = 3
+    STATE_CHOICES = (
+        (ST_PENDING, 'Pending'),
+        (ST_DISPATCHED, 'Dispatched'),
+        (ST_RUNNING, 'Running'),
+        (ST_DONE, 'Done'),
+    )
+
+    #Whether the run found the autograder's dependency cache already built
+    DEPS_HIT = 'hit'
+    DEPS_MISS = 'miss'
+    DEPS_CHOICES = (
+        ('', 'No dependency cache'),
+        (DEPS_HIT, 'Hit'),
+        (DEPS_MISS, 'Miss'),
+    )
+
+    #########################
+    # Start of model fields #
+    #########################
+
+    #Result the job fills in, and what it is grading
+    #A sharded autograder has one job per shard filling in the same result
+    result = models.ForeignKey('AutograderResult', on_delete=models.CASCADE)
+    course = models.ForeignKey('Course', on_delete=models.CASCADE)
+    assignment = models.ForeignKey('Assignment', on_delete=models.CASCADE)
+
+    #Paths to the submission zip and autograder zip
+    submission_zip = models.TextField()
+    autograder_zip = models.TextField()
+
+    #Hash of the autograder zip, identifying the autograder version for runtime estimates
+    autograder_hash = models.CharField(max_length=64, blank=True, db_index=True)
+
+    #Hash of the submission zip, used by remote workers to fetch it
+    submission_hash = models.CharField(max_length=64, blank=True, db_index=True)
+
+    #Which shard of the autograder this job runs, out of how many
+    shard_index = models.IntegerField(default=0)
+    shard_count = models.IntegerField(default=1)
+
+    #Exit code of the autograde script, and the resource limit that killed it if any
+    returncode = models.IntegerField(blank=True, null=True)
+    killed_by = models.CharField(max_length=10, blank=True, default='')
+
+    #Whether the run used or built the autograder's dependency cache (see above)
+    deps_cache = models.CharField(max_length=4, choices=DEPS_CHOICES, blank=True, default='')
+
+    #Current state (see above) and django-q task id once dispatched
+    state = models.IntegerField(choices=STATE_CHOICES, default=ST_PENDING, db_index=True)
+    task_id = models.CharField(max_length=32, blank=True)
+
+    #Number of attempts at running the job, and the worker holding the
+    #current attempt's lease until when (see grader/lease.py)
+    attempt = models.IntegerField(default=0)
+    lease_owner = models.CharField(max_length=128, blank=True)
+    lease_expires = models.DateTimeField(blank=True, null=True)
+
+    #Time the job was queued, handed to the task queue, picked up by a worker, and finished
+    enqueued_at = models.DateTimeField(auto_now_add=True)
+    dispatched_at = models.DateTimeField(blank=True, null=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    #######################
+    # End of model fields #
+    #######################
+
+    def get_queue_wait(self):
+        """
+        Returns how long the job waited for a worker, or None if it hasn't started
+        """
+        if not self.started_at:
+            return None
+        return self.started_at - self.enqueued_at
+
+    def __str__(self):
+        """
+        Returns string specifying the submission and job state
+        """
+        return "%s (%s)" % (self.result.submission, dict(self.STATE_CHOICES)[self.state])
     
 
+class AutograderTiming(models.Model):
+    """
+    Stores how long one phase of an autograder run took
+    Phases other than queue are timed by autograde.sh, see grader/metrics.py
+    """
+
+    #Phases of a run, in the order they happen
+    PHASE_CHOICES = (
+        ('queue', 'Queue wait'),
+        ('deps', 'Dependency build'),
+        ('autograder', 'Autograder setup'),
+        ('submission', 'Submission unzip'),
+        ('run', 'run_autograder'),
+        ('results', 'Results harvest'),
+    )
+
+    #########################
+    # Start of model fields #
+    #########################
+
+    #Result the run filled in (none once the result is discarded, e.g. by a regrade)
+    result = models.ForeignKey('AutograderResult', blank=True, null=True, on_delete=models.SET_NULL)
+    assignment = models.ForeignKey('Assignment', on_delete=models.CASCADE)
+
+    #Shard of a sharded autograder the run was for
+    shard_index = models.IntegerField(default=0)
+
+    phase = models.CharField(max_length=16, choices=PHASE_CHOICES)
+    seconds = models.FloatField()
+
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    #######################
+    # End of model fields #
+    #######################
+
+    def __str__(self):
+        """
+        Returns string specifying the assignment, phase and time taken
+        """
+        return "%s %s (%.2fs)" % (self.assignment, self.phase, self.seconds)
+
+
+class RuntimeEstimate(models.Model):
+    """
+    Stores a rolling estimate of how long an assignment's autograder takes to run
+    Kept separately for each version (zip hash) of the autograder
+    """
+
+    #Estimate used for autograders that have never run
+    DEFAULT_SECONDS = 60
+
+    #Weight of the newest run in the rolling average
+    ALPHA = 0.2
+
+    #########################
+    # Start of model fields #
+    #########################
+
+    assignment = models.ForeignKey('Assignment', on_delete=models.CASCADE)
+    autograder_hash = models.CharField(max_length=64)
+
+    #Exponentially weighted average run time in seconds, and number of runs seen
+    seconds = models.FloatField()
+    samples = models.IntegerField(default=0)
+
+    updated = models.DateTimeField(auto_now=True)
+
+    #######################
+    # End of model fields #
+    #######################
+
+    class Meta:
+        unique_together = ('assignment', 'autograder_hash')
+
+    @staticmethod
+    def record(assignment_id, autograder_hash, seconds):
+        """
+        Folds the run time of a finished run into the estimate
+        """
+        with transaction.atomic():
+            est, created = RuntimeEstimate.objects.select_for_update().get_or_create(
+                assignment_id=assignment_id, autograder_hash=autograder_hash,
+                defaults={'seconds': seconds})
+            if not created:
+                est.seconds = RuntimeEstimate.ALPHA * seconds + (1 - RuntimeEstimate.ALPHA) * est.seconds
+            est.samples += 1
+            est.save()
+        return est
+
+    @staticmethod
+    def get_estimates(keys):
+        """
+        Returns dict mapping (assignment id, autograder hash) to expected run time in seconds
+        Falls back to the assignment's most recent estimate for a new autograder
+        version, then to DEFAULT_SECONDS
+        """
+        keys = set(keys)
+        estimates = dict()
+        latest = dict()
+        rows = RuntimeEstimate.objects.filter(assignment_id__in={a for a, h in keys}).order_by('updated')
+        for est in rows:
+            estimates[(est.assignment_id, est.autograder_hash)] = est.seconds
+            latest[est.assignment_id] = est.seconds
+
+        return {(a, h): estimates.get((a, h), latest.get(a, RuntimeEstimate.DEFAULT_SECONDS))
+                for a, h in keys}
+
+    def __str__(self):
+        """
+        Returns string specifying the assignment and its expected run time
+        """
+        return "%s %s (%.1fs over %d runs)" % (self.assignment, self.autograder_hash[:8], self.seconds, self.samples)
+
+
+class ScalingDecision(models.Model):
+    """
+    Stores a change in the number of autograder workers made by the autoscaler
+    along with what it was based on, see grader/autoscale.py
+    """
+
+    #########################
+    # Start of model fields #
+    #########################
+
+    #Workers after the change; none once the autoscaler has stopped
+    workers = models.IntegerField(blank=True, null=True)
+    previous = models.IntegerField(default=0)
+
+    #Jobs queued and running, and workers wanted for upcoming due dates
+    queued = models.IntegerField(default=0)
+    running = models.IntegerField(default=0)
+    predicted = models.IntegerField(default=0)
+
+    #Host load average per core
+    load = models.FloatField(default=0)
+
+    reason = models.CharField(max_length=200, blank=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    #######################
+    # End of model fields #
+    #######################
+
+    def __str__(self):
+        """
+        Returns string specifying the change in workers and when it was made
+        """
+        return "%s: %s -> %s workers" % (self.created, self.previous, self.workers)
+
+
+class RegradeBatch(models.Model):
+    """
+    Stores a rerun of the autograder over every current submission for an assignment
+    Submissions are fed to the scheduler a chunk at a time, see grader/regrade.py
+    """
+
+    #########################
+    # Start of model fields #
+    #########################
+
+    assignment = models.ForeignKey('Assignment', on_delete=models.CASCADE)
+
+    #User who started the regrade (none if started from the command line)
+    started_by = models.ForeignKey(User, blank=True, null=True, on_delete=models.SET_NULL)
+
+    #Time the regrade started and finished
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    #######################
+    # End of model fields #
+    #######################
+
+    def get_counts(self):
+        """
+        Returns dict with the number of submissions in the batch, queued so far, and finished
+        """
+        return self.regradeitem_set.aggregate(
+            total=models.Count('id'),
+            queued=models.Count('id', filter=models.Q(queued=True)),
+            done=models.Count('id', filter=models.Q(done=True)))
+
+    def __str__(self):
+        """
+        Returns string specifying the assignment and when the regrade started
+        """
+        return "%s regrade (%s)" % (self.assignment, self.created)
+
+
+class RegradeItem(models.Model):
+    """
+    Stores one submission in a regrade with its autograder score before and after
+    """
+
+    #########################
+    # Start of model fields #
+    #########################
+
+    batch = models.ForeignKey('RegradeBatch', on_delete=models.CASCADE)
+    submission = models.ForeignKey('Submission', on_delete=models.CASCADE)
+
+    #Autograder score before and after the regrade (none if there was no result)
+    old_score = models.FloatField(blank=True, null=True)
+    new_score = models.FloatField(blank=True, null=True)
+
+    #Whether the submission was handed to the scheduler, and whether its run finished
+    queued = models.BooleanField(default=False)
+    done = models.BooleanField(default=False)
+
+    #######################
+    # End of model fields #
+    #######################
+
+    def get_change(self):
+        """
+        Returns the change in score, or None if either score is missing
+        """
+        if self.old_score is None or self.new_score is None:
+            return None
+        return self.new_score - self.old_score
+
+
 def load_user_groups(user):
     """
     Stores attributes "is_faculty" and "is_student" within user based on groups
@@ -710,7 +1214,7 @@ def load_user_groups(user):
     if not user.is_authenticated:
         return False
         
-    user.is_faculty = len(user.groups.filter(name='faculty')) > 0
+    user.is_faculty = roles.get_roles(user)['faculty']
     user.is_student = not user.is_faculty
 
     return True
@@ -0,0 +1,117 @@
+"""
+Bulk regrading of an assignment after its autograder changes
+
+A regrade reruns the autograder on the current (non-previous) submission of
+every student. Rather than queueing them all at once, at most
+AUTOGRADER_REGRADE_CHUNK submissions from a batch are with the scheduler at a
+time, and each finished run feeds the next one in, so a regrade never buries
+new student submissions.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+import os
+import shutil
+
+from grader.models import AutograderResult, Submission, RegradeBatch, RegradeItem
+import grader.tasks
+
+
+def rerun(sub, force=True):
+    """
+    Discards a submission's autograder result and queues a fresh run
+    Unless force is set, an identical submission's result may be reused
+    instead, see grader.tasks.autograde_submission
+    Returns list of queued AutogradeJobs, or None if nothing was queued
+    """
+    #Deleting the result also removes its finished job
+    AutograderResult.objects.filter(submission=sub).delete()
+    shutil.rmtree(sub.get_directory(subdir=Submission.REPORT_DIR), ignore_errors=True)
+
+    #Keep manual grades, but show everything else as waiting on the autograder
+    if sub.status != Submission.CH_GRADED:
+        sub.status = Submission.CH_TO_AUTOGRADE
+        sub.save()
+
+    subzip = sub.get_filename()
+    if subzip:
+        subzip = os.path.join(sub.get_directory(), subzip)
+    return grader.tasks.autograde_submission(sub, subzip, force=force)
+
+
+def start(assignment, user=None):
+    """
+    Starts a regrade of every current submission for an assignment
+    Returns the new batch, or the one already running for the assignment
+    """
+    with transaction.atomic():
+        batch = RegradeBatch.objects.select_for_update().filter(assignment=assignment, finished__isnull=True).first()
+        if batch:
+            return batch
+
+        batch = RegradeBatch.objects.create(assignment=assignment, started_by=user)
+        subs = assignment.submission_set.exclude(status=Submission.CH_PREVIOUS).select_related('autograderresult')
+        RegradeItem.objects.bulk_create([
+            RegradeItem(batch=batch, submission=s,
+                        old_score=s.autograderresult.score if hasattr(s, 'autograderresult') else None)
+            for s in subs])
+
+    feed(batch)
+    return batch
+
+
+def feed(batch):
+    """
+    Queues submissions from a batch until a full chunk is with the scheduler
+    Submissions the autograder couldn't be run on are recorded straight away
+    and their places in the chunk refilled, in a loop rather than through
+    item_done so that a long run of them can't exhaust the stack
+    Marks the batch finished once every submission has been regraded
+    """
+    while True:
+        with transaction.atomic():
+            batch = RegradeBatch.objects.select_for_update().get(id=batch.id)
+            in_flight = batch.regradeitem_set.filter(queued=True, done=False).count()
+            items = list(batch.regradeitem_set.filter(queued=False).select_related('submission')
+                         [:max(0, settings.AUTOGRADER_REGRADE_CHUNK - in_flight)])
+            RegradeItem.objects.filter(id__in=[i.id for i in items]).update(queued=True)
+
+        #Nothing to wait for if the autograder couldn't be run
+        skipped = [item for item in items if not rerun(item.submission)]
+        for item in skipped:
+            record_score(item.submission)
+        if not skipped:
+            break
+
+    if not batch.regradeitem_set.filter(done=False).exists():
+        RegradeBatch.objects.filter(id=batch.id, finished__isnull=True).update(finished=timezone.now())
+
+
+def record_score(sub):
+    """
+    Records the new score of a regraded submission
+    Returns its RegradeItem, or None if the submission isn't part of a
+    running regrade
+    """
+    item = RegradeItem.objects.filter(submission=sub, queued=True, done=False,
+                                      batch__finished__isnull=True).first()
+    if not item:
+        return None
+
+    result = AutograderResult.objects.filter(submission=sub).first()
+    item.new_score = result.score if result else None
+    item.done = True
+    item.save()
+    return item
+
+
+def item_done(sub):
+    """
+    Records the new score of a regraded submission and feeds the next one in
+    Called for every finished autograder run; does nothing if the submission
+    isn't part of a running regrade
+    """
+    item = record_score(sub)
+    if item:
+        feed(item.batch)
@@ -0,0 +1,134 @@
+"""
+Autograder workers on hosts that don't share the web host's filesystem
+
+A worker host runs the qcluster against the same database and broker as the
+web host, with AUTOGRADER_REMOTE_URL set to the web host's URL. Instead of
+reading the submission and autograder zips from their paths, it fetches them
+by sha256 from the web host's artifact endpoint and keeps them in
+AUTOGRADER_ARTIFACT_DIR. Once a run finishes, it pushes the results
+directory, log and run status back to the web host, which fills in the
+result just as a local worker would. Both endpoints require
+AUTOGRADER_WORKER_TOKEN.
+"""
+
+from django.conf import settings
+from pathlib import Path
+from zipfile import ZipFile
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+
+import requests
+
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+#Seconds to wait on the web host before giving up on a request
+REQUEST_TIMEOUT = 60
+
+
+def is_remote():
+    """
+    Returns whether this host is a worker that doesn't share the web host's filesystem
+    """
+    return bool(settings.AUTOGRADER_REMOTE_URL)
+
+
+def check_token(request):
+    """
+    Returns whether a request to a worker endpoint carries the worker token
+    """
+    token = settings.AUTOGRADER_WORKER_TOKEN
+    given = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and hmac.compare_digest(given, 'Bearer ' + token)
+
+
+def _get_url(path):
+    return settings.AUTOGRADER_REMOTE_URL.rstrip('/') + path
+
+
+def _get_headers():
+    return {'Authorization': 'Bearer ' + (settings.AUTOGRADER_WORKER_TOKEN or '')}
+
+
+def fetch_artifact(digest):
+    """
+    Returns the local path of the zip with the given sha256, downloading it
+    from the web host unless it was fetched before
+    """
+    artifact_dir = Path(settings.AUTOGRADER_ARTIFACT_DIR)
+    artifact_dir.mkdir(parents=True, exist_ok=True)
+    path = artifact_dir / ('%s.zip' % digest)
+
+    if not path.exists():
+        #Download beside the final path and rename, so nobody sees a partial zip
+        fd, scratch = tempfile.mkstemp(dir=artifact_dir, prefix='.fetch-')
+        try:
+            sha = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as f, requests.get(_get_url('/artifacts/%s' % digest), headers=_get_headers(),
+                                                       stream=True, timeout=REQUEST_TIMEOUT) as r:
+                r.raise_for_status()
+                for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    sha.update(chunk)
+                    f.write(chunk)
+
+            if sha.hexdigest() != digest:
+                raise IOError('Artifact %s arrived with hash %s' % (digest, sha.hexdigest()))
+            os.rename(scratch, path)
+        finally:
+            if os.path.exists(scratch):
+                os.remove(scratch)
+
+        evict()
+
+    #File mtime doubles as the last-used time for eviction
+    os.utime(path)
+    return path
+
+
+def evict(max_size=None):
+    """
+    Removes least recently used zips until the fetched zips fit within max_size bytes
+    """
+    if max_size is None:
+        max_size = settings.AUTOGRADER_ARTIFACT_MAX_SIZE
+
+    zips = list()
+    for path in Path(settings.AUTOGRADER_ARTIFACT_DIR).glob('*.zip'):
+        try:
+            info = path.stat()
+            zips.append((info.st_mtime, info.st_size, path))
+        except OSError:
+            continue
+
+    total = sum(size for used, size, path in zips)
+    for used, size, path in sorted(zips)[:-1]:
+        if total <= max_size:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total -= size
+
+
+def push_results(job, status, results_dir, log):
+    """
+    Sends the results directory, log and status of a finished job to the web host
+    """
+    with tempfile.TemporaryFile() as archive:
+        with ZipFile(archive, 'w') as z:
+            for path, dirs, files in os.walk(results_dir):
+                for f in files:
+                    fpath = os.path.join(path, f)
+                    z.write(fpath, os.path.relpath(fpath, results_dir))
+        archive.seek(0)
+
+        with open(log, 'rb') as log_file:
+            r = requests.post(_get_url('/worker/jobs/%d/complete' % job.id), headers=_get_headers(),
+                              data={'status': json.dumps(status)},
+                              files={'results': archive, 'log': log_file},
+                              timeout=REQUEST_TIMEOUT)
+    r.raise_for_status()
@@ -0,0 +1,133 @@
+"""
+Course roles of a user, resolved once per request
+
+Course.has_student, has_instructor and has_ta and load_user_groups all read
+from get_roles(), which finds whether the user is faculty and every course
+they are a student, instructor or TA of with a single query. The roles are
+kept on the user object, which lives as long as the request, and in the
+ROLE_CACHE cache for ROLE_CACHE_TIMEOUT seconds.
+
+Cached roles are stored under the user's current version stamp. Changing a
+course roster or the user's groups gives each user involved a new stamp once
+the change commits, so their old roles are never read again.
+"""
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import CharField, Value
+from django.db.models.signals import m2m_changed
+import uuid
+
+
+#Course fields listing the users with each role
+ROLES = ('students', 'instructors', 'tas')
+
+#Group whose members are faculty
+FACULTY_GROUP = 'faculty'
+
+VERSION_KEY = 'course-roles-version:%d'
+ROLES_KEY = 'course-roles:%d:%s'
+
+
+def get_cache():
+    return caches[settings.ROLE_CACHE]
+
+
+def get_version(user_id):
+    """
+    Returns the version stamp of a user's roles
+    """
+    cache = get_cache()
+    version = cache.get(VERSION_KEY % user_id)
+    if version is None:
+        #Another process may have stamped the user first
+        cache.add(VERSION_KEY % user_id, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY % user_id)
+    return version
+
+
+def load(user_id):
+    """
+    Loads a user's roles from the database
+    Returns a dict of whether they are faculty, and the ids of the courses
+    they hold each of ROLES in
+    """
+    Course = apps.get_model('grader', 'Course')
+    queries = [getattr(Course, role).through.objects.filter(user_id=user_id)
+               .values_list('course_id', Value(role, output_field=CharField()))
+               for role in ROLES]
+    faculty = (User.groups.through.objects.filter(user_id=user_id, group__name=FACULTY_GROUP)
+               .values_list('user_id', Value('faculty', output_field=CharField())))
+
+    roles = {role: set() for role in ROLES}
+    roles['faculty'] = False
+    for course_id, role in queries[0].union(*queries[1:], faculty, all=True):
+        if role == 'faculty':
+            roles['faculty'] = True
+        else:
+            roles[role].add(course_id)
+
+    return roles
+
+
+def get_roles(user):
+    """
+    Returns a user's roles (see load), from the user object or the cache if
+    they were already loaded
+    Users who aren't logged in have no roles
+    """
+    if not user.is_authenticated:
+        return dict({role: set() for role in ROLES}, faculty=False)
+
+    roles = getattr(user, '_course_roles', None)
+    if roles is None:
+        key = ROLES_KEY % (user.id, get_version(user.id))
+        roles = get_cache().get(key)
+        if roles is None:
+            roles = load(user.id)
+            get_cache().set(key, roles, settings.ROLE_CACHE_TIMEOUT)
+        user._course_roles = roles
+    return roles
+
+
+def invalidate(user_ids):
+    """
+    Gives users new version stamps, once the current transaction commits
+    """
+    user_ids = list(user_ids)
+
+    def stamp():
+        get_cache().set_many({VERSION_KEY % i: uuid.uuid4().hex for i in user_ids}, None)
+
+    if user_ids:
+        transaction.on_commit(stamp)
+
+
+def roster_changed(sender, instance, action, pk_set, **kwargs):
+    """
+    Invalidates the roles of the users added to or removed from a course
+    roster or group, from either side of the relation
+    """
+    if isinstance(instance, User):
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        invalidate(pk_set)
+    elif action == 'pre_clear':
+        #Who was on the roster is gone by post_clear
+        invalidate(sender.objects.filter(**{instance._meta.model_name: instance})
+                   .values_list('user_id', flat=True))
+
+
+def connect():
+    """
+    Connects roster_changed to every relation roles are loaded from
+    """
+    Course = apps.get_model('grader', 'Course')
+    for role in ROLES:
+        m2m_changed.connect(roster_changed, sender=getattr(Course, role).through,
+                            dispatch_uid='roles-%s' % role)
+    m2m_changed.connect(roster_changed, sender=User.groups.through, dispatch_uid='roles-groups')
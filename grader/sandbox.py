@@ -0,0 +1,242 @@
+"""
+Resource envelope for autograder runs
+
+Each run gets a CPU quota, memory cap, pids limit, CPU time limit and wall
+clock timeout taken from its Assignment, and is pinned to its own set of
+cores so concurrent runs don't compete for them. Limits are enforced with a
+cgroup v2 group under AUTOGRADER_CGROUP_ROOT when that directory exists and
+is writable (e.g. delegated to the service user by systemd). Otherwise the
+run falls back to rlimits, which cannot enforce the CPU quota or pids limit
+and cap the data segment rather than resident memory.
+
+The limits are applied by wrapping the command (see get_wrapper) rather than
+in a preexec_fn, which is unsafe once the worker has other threads running,
+such as the lease heartbeat.
+"""
+
+from django.conf import settings
+from pathlib import Path
+import fcntl
+import logging
+import os
+import signal
+import subprocess
+import time
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+#Names used to record which limit killed a run (see AutograderResult.killed_by)
+KILLED_WALL = 'wall'
+KILLED_CPU = 'cpu'
+KILLED_MEMORY = 'memory'
+KILLED_PIDS = 'pids'
+
+#Recorded for a run stopped because it was no longer wanted, see run_limited()
+KILLED_STOPPED = 'stopped'
+
+#cgroup v2 period for the CPU quota, in microseconds
+CPU_PERIOD = 100000
+
+#How often the CPU time of a cgroup is checked, in seconds
+POLL_INTERVAL = 1
+
+#Moves the shell into the cgroup named by its first argument, then runs the rest
+ENTER_CGROUP = 'echo $$ > "$1" && shift && exec "$@"'
+
+
+class LimitedProcess(subprocess.CompletedProcess):
+    """
+    CompletedProcess that also records which limit, if any, killed the process
+    """
+    def __init__(self, args, returncode, stdout=None, stderr=None, killed_by=''):
+        super().__init__(args, returncode, stdout, stderr)
+        self.killed_by = killed_by
+
+
+def get_cpu_sets(slots):
+    """
+    Splits the cores this process may use into one set per autograder slot
+    Slots share cores round robin if there are fewer cores than slots
+    """
+    cpus = sorted(os.sched_getaffinity(0))
+    per_slot = max(1, len(cpus) // slots)
+    return [[cpus[(i * per_slot + j) % len(cpus)] for j in range(per_slot)] for i in range(slots)]
+
+
+def acquire_cpu_slot():
+    """
+    Locks a free CPU slot shared between all workers on this host
+    Returns (lock file, cores) or (None, None) if every slot is taken
+    The slot is released when the lock file is closed
+    """
+    slot_dir = Path(settings.AUTOGRADER_WORK_DIR) / '.cpuslots'
+    slot_dir.mkdir(parents=True, exist_ok=True)
+
+    for i, cpus in enumerate(get_cpu_sets(settings.AUTOGRADER_SLOTS)):
+        f = open(slot_dir / str(i), 'w')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return f, cpus
+        except BlockingIOError:
+            f.close()
+
+    return None, None
+
+
+def make_cgroup(limits):
+    """
+    Creates a cgroup for one run with the given limits
+    Returns its path, or None if cgroups are unavailable
+    """
+    root = settings.AUTOGRADER_CGROUP_ROOT
+    if not root or not os.access(root, os.W_OK):
+        return None
+
+    cgroup = Path(root) / ('autograde-%s' % uuid.uuid4().hex)
+    try:
+        cgroup.mkdir()
+        (cgroup / 'cpu.max').write_text('%d %d' % (limits['cpu_quota'] * CPU_PERIOD, CPU_PERIOD))
+        (cgroup / 'memory.max').write_text(str(limits['memory_limit'] * 1024 * 1024))
+        (cgroup / 'memory.swap.max').write_text('0')
+        (cgroup / 'pids.max').write_text(str(limits['pids_limit']))
+    except OSError:
+        logger.warning("Could not set up cgroup %s, falling back to rlimits", cgroup, exc_info=True)
+        remove_cgroup(cgroup)
+        return None
+
+    return cgroup
+
+
+def read_cgroup_stat(cgroup, filename, key):
+    """
+    Returns a value from a flat keyed cgroup file such as cpu.stat or memory.events
+    """
+    try:
+        for line in (cgroup / filename).read_text().splitlines():
+            name, value = line.split()
+            if name == key:
+                return int(value)
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def kill_cgroup(cgroup):
+    """
+    Kills every process left in a cgroup
+    """
+    try:
+        (cgroup / 'cgroup.kill').write_text('1')
+    except OSError:
+        #cgroup.kill needs Linux 5.14, kill processes one at a time before that
+        try:
+            for pid in (cgroup / 'cgroup.procs').read_text().split():
+                os.kill(int(pid), signal.SIGKILL)
+        except (OSError, ValueError):
+            pass
+
+
+def remove_cgroup(cgroup):
+    """
+    Removes a cgroup once it is empty
+    """
+    for i in range(10):
+        try:
+            cgroup.rmdir()
+            return
+        except FileNotFoundError:
+            return
+        except OSError:
+            kill_cgroup(cgroup)
+            time.sleep(0.1)
+
+
+def get_wrapper(limits, cgroup, cpus):
+    """
+    Returns the command that runs a command under the given limits
+    Each step execs the next, so the command keeps the wrapper's process id
+    The CPU time limit is per process; rlimits stand in for the cgroup's
+    memory cap when there is no cgroup, using the data segment since an
+    address space limit is too tight for the JVM, Go and sanitizers, which
+    reserve far more than they use
+    """
+    wrapper = list()
+    if cgroup:
+        wrapper += ['sh', '-c', ENTER_CGROUP, 'sh', str(cgroup / 'cgroup.procs')]
+    if cpus:
+        wrapper += ['taskset', '--cpu-list', ','.join(str(cpu) for cpu in cpus)]
+
+    cpu_time = limits['cpu_timeout']
+    wrapper += ['prlimit', '--cpu=%d:%d' % (cpu_time, cpu_time + 5)]
+    if not cgroup:
+        memory = limits['memory_limit'] * 1024 * 1024
+        wrapper.append('--data=%d:%d' % (memory, memory))
+    return wrapper + ['--']
+
+
+def run_limited(args, limits, extra_env=None, should_stop=None, **kwargs):
+    """
+    Runs a command inside a resource envelope and captures its output
+    limits is a dict as returned by Assignment.get_limits()
+    extra_env holds environment variables to set on top of the worker's own
+    should_stop is checked every POLL_INTERVAL, and the run is killed once it returns True
+    Output is captured unless stdout/stderr are given, e.g. as an open log file
+    Returns a LimitedProcess recording which limit killed the command, if any
+    """
+    kwargs.setdefault('stdout', subprocess.PIPE)
+    kwargs.setdefault('stderr', subprocess.PIPE)
+    if extra_env:
+        kwargs['env'] = dict(os.environ, **extra_env)
+
+    slot_lock, cpus = acquire_cpu_slot() if settings.AUTOGRADER_CPU_PINNING else (None, None)
+    cgroup = make_cgroup(limits)
+
+    killed_by = ''
+    deadline = time.monotonic() + limits['wall_timeout']
+    try:
+        proc = subprocess.Popen(get_wrapper(limits, cgroup, cpus) + list(args),
+                                start_new_session=True, **kwargs)
+        while True:
+            try:
+                stdout, stderr = proc.communicate(timeout=POLL_INTERVAL)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+
+            #Wall clock and (with cgroups) total CPU time of every process in the run
+            if time.monotonic() > deadline:
+                killed_by = KILLED_WALL
+            elif cgroup and read_cgroup_stat(cgroup, 'cpu.stat', 'usage_usec') > limits['cpu_timeout'] * 1000000:
+                killed_by = KILLED_CPU
+            elif should_stop and should_stop():
+                killed_by = KILLED_STOPPED
+
+            if killed_by:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                if cgroup:
+                    kill_cgroup(cgroup)
+                stdout, stderr = proc.communicate()
+                break
+
+        #Work out which limit stopped the run if it wasn't the wall clock
+        #The shell reports a child killed by a signal as 128 + signal
+        if not killed_by and proc.returncode != 0:
+            if proc.returncode in (-signal.SIGXCPU, 128 + signal.SIGXCPU):
+                killed_by = KILLED_CPU
+            elif cgroup and read_cgroup_stat(cgroup, 'memory.events', 'oom_kill') > 0:
+                killed_by = KILLED_MEMORY
+            elif cgroup and read_cgroup_stat(cgroup, 'pids.events', 'max') > 0:
+                killed_by = KILLED_PIDS
+
+        return LimitedProcess(args, proc.returncode, stdout, stderr, killed_by)
+
+    finally:
+        if cgroup:
+            remove_cgroup(cgroup)
+        if slot_lock:
+            slot_lock.close()
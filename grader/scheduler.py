@@ -0,0 +1,308 @@
+"""
+Fair-share scheduling of autograder jobs
+
+Autograder runs are not handed to django-q as soon as they are submitted.
+They are stored as AutogradeJobs and dispatched here, at most AUTOGRADER_SLOTS
+(or the autoscaled pool size, see grader/autoscale.py) at a time, so the
+cluster's FIFO queue never holds more than it can run.
+Whenever a worker frees up, the next job is taken from the course with the
+fewest running jobs relative to its autograde_weight, and within that course
+from the assignment with the fewest running jobs. Within an assignment, jobs
+go shortest-expected-first using each autograder's RuntimeEstimate, aged by
+their response ratio so long jobs are not starved. Courses may reserve
+workers, which other courses cannot take even when idle.
+
+A student's new submission cancels the unfinished jobs of their earlier
+submissions to the assignment, so resubmitting never holds more than one
+worker.
+"""
+
+from django_q.tasks import async_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from collections import Counter, defaultdict
+from datetime import timedelta
+import heapq
+
+from grader.models import AutogradeJob, AutograderResult, Course, RuntimeEstimate
+from grader import autograder_cache, autoscale
+
+
+TASK_NAME_PREFIX = 'autograde-'
+
+
+def get_capacity():
+    """
+    Returns the number of autograder jobs that may run at once
+    Follows the worker pool while ./manage.py autoscale is running
+    """
+    pool = autoscale.get_pool_size()
+    return min(pool, settings.AUTOGRADER_SLOTS) if pool else settings.AUTOGRADER_SLOTS
+
+
+def submit(*jobs):
+    """
+    Queues new jobs and dispatches whatever fits in the free workers
+    """
+    for job in jobs:
+        job.state = AutogradeJob.ST_PENDING
+        job.save()
+    dispatch()
+
+
+def dispatch():
+    """
+    Hands pending jobs to the task queue until all workers are busy
+    Returns list of dispatched jobs
+    """
+    with transaction.atomic():
+        #Locking every queued job serializes concurrent dispatchers
+        jobs = list(AutogradeJob.objects.select_for_update()
+                    .exclude(state=AutogradeJob.ST_DONE)
+                    .order_by('enqueued_at', 'id'))
+
+        estimates = RuntimeEstimate.get_estimates((j.assignment_id, j.autograder_hash) for j in jobs)
+        chosen = pick_jobs(jobs, get_capacity(), estimates)
+
+        now = timezone.now()
+        for job in chosen:
+            job.state = AutogradeJob.ST_DISPATCHED
+            job.dispatched_at = now
+            job.save(update_fields=['state', 'dispatched_at'])
+
+    #Enqueue after commit so workers never see an uncommitted job
+    for job in chosen:
+        job.task_id = _enqueue(job)
+        job.save(update_fields=['task_id'])
+
+    return chosen
+
+
+def response_ratio(job, expected, now):
+    """
+    Returns (time waited + expected run time) / expected run time
+    Grows faster for short jobs, but grows for every job the longer it waits
+    """
+    expected = max(expected, 1)
+    waited = (now - job.enqueued_at).total_seconds()
+    return (waited + expected) / expected
+
+
+def pick_jobs(jobs, capacity, estimates=None, now=None):
+    """
+    Chooses which pending jobs to dispatch, using weighted fair sharing between
+    courses and then between assignments within a course, and highest
+    response ratio next within an assignment
+    jobs must contain every job not yet done, oldest first
+    estimates maps (assignment id, autograder hash) to expected run time in seconds
+    """
+    estimates = estimates or dict()
+    now = now or timezone.now()
+    running_course = Counter()
+    running_assgn = Counter()
+    queues = defaultdict(lambda: defaultdict(list))
+
+    for job in jobs:
+        if job.state == AutogradeJob.ST_PENDING:
+            queues[job.course_id][job.assignment_id].append(job)
+        else:
+            running_course[job.course_id] += 1
+            running_assgn[job.assignment_id] += 1
+
+    def priority(job):
+        expected = estimates.get((job.assignment_id, job.autograder_hash), RuntimeEstimate.DEFAULT_SECONDS)
+        return (-response_ratio(job, expected, now), expected, job.enqueued_at)
+
+    #Order each assignment's queue by priority; nothing waits long enough
+    #during one dispatch for the order to change
+    for course_queues in queues.values():
+        for queue in course_queues.values():
+            queue.sort(key=priority)
+
+    free = capacity - sum(running_course.values())
+
+    #Load weights and reservations for every course that could need them
+    courses = {c.id: c for c in Course.objects.filter(id__in=list(queues))}
+    for c in Course.objects.filter(reserved_workers__gt=0):
+        courses[c.id] = c
+
+    def unused_reservation(cid):
+        return max(0, courses[cid].reserved_workers - running_course[cid])
+
+    def head(cid):
+        return min(priority(q[0]) for q in queues[cid].values())
+
+
+    chosen = list()
+    while free > 0 and queues:
+
+        #A course may use a free worker unless it is held for another course's reservation
+        held = sum(unused_reservation(cid) for cid in courses)
+        candidates = [cid for cid in queues
+                      if unused_reservation(cid) > 0 or free > held - unused_reservation(cid)]
+        if not candidates:
+            break
+
+        #Course with the least running work for its weight, best next job breaking ties
+        cid = min(candidates, key=lambda c: (running_course[c] / max(courses[c].autograde_weight, 0.01), head(c)))
+
+        #Assignment in that course with the fewest running jobs, best next job breaking ties
+        aid = min(queues[cid], key=lambda a: (running_assgn[a], priority(queues[cid][a][0])))
+
+        job = queues[cid][aid].pop(0)
+        if not queues[cid][aid]:
+            del queues[cid][aid]
+        if not queues[cid]:
+            del queues[cid]
+
+        running_course[cid] += 1
+        running_assgn[aid] += 1
+        free -= 1
+        chosen.append(job)
+
+    return chosen
+
+
+def cancel_superseded(sub):
+    """
+    Cancels the unfinished jobs of a student's earlier submissions to an assignment
+    Jobs are marked done straight away, so queued ones never start and running
+    ones are killed once their heartbeat finds they lost their lease; the
+    cancellation is recorded on each earlier submission's AutograderResult
+    Returns list of submissions whose run was cancelled
+    """
+    unfinished = (AutogradeJob.objects.filter(result__submission__assignment_id=sub.assignment_id,
+                                              result__submission__student_id=sub.student_id)
+                  .exclude(result__submission=sub).exclude(state=AutogradeJob.ST_DONE))
+    result_ids = set(unfinished.values_list('result_id', flat=True))
+    if not result_ids:
+        return []
+
+    now = timezone.now()
+    with transaction.atomic():
+        #Locking the results serializes this with complete_job
+        results = list(AutograderResult.objects.select_for_update().select_related('submission')
+                       .filter(id__in=result_ids))
+        AutogradeJob.objects.filter(result_id__in=result_ids).exclude(state=AutogradeJob.ST_DONE) \
+                            .update(state=AutogradeJob.ST_DONE, finished_at=now)
+        for ag_res in results:
+            ag_res.score = 0
+            ag_res.autograde_success = False
+            ag_res.cancelled = now
+            ag_res.save()
+
+    return [ag_res.submission for ag_res in results]
+
+
+def estimate_queue(now=None):
+    """
+    Returns dict mapping the id of every AutograderResult still being worked on to
+    (queue position, estimated finish time); position 0 means it is running
+    Estimated by playing the queue forward in the order pick_jobs would dispatch
+    it, with every job taking its RuntimeEstimate
+    """
+    now = now or timezone.now()
+    jobs = list(AutogradeJob.objects.exclude(state=AutogradeJob.ST_DONE).order_by('enqueued_at', 'id'))
+    estimates = RuntimeEstimate.get_estimates((j.assignment_id, j.autograder_hash) for j in jobs)
+
+    def expected(job):
+        return estimates.get((job.assignment_id, job.autograder_hash), RuntimeEstimate.DEFAULT_SECONDS)
+
+    queue = dict()
+    def add(job, position, finish):
+        prev_position, prev_finish = queue.get(job.result_id, (position, finish))
+        queue[job.result_id] = (min(position, prev_position), max(finish, prev_finish))
+
+    #Each worker is free once the job on it is expected to finish
+    free_at = [0] * get_capacity()
+    for job in jobs:
+        if job.state in (AutogradeJob.ST_DISPATCHED, AutogradeJob.ST_RUNNING):
+            remaining = max(0, expected(job) - (now - (job.started_at or now)).total_seconds())
+            heapq.heapreplace(free_at, remaining)
+            add(job, 0, remaining)
+
+    #Pending jobs in dispatch order, as if every one of them had a worker
+    pending = [j for j in jobs if j.state == AutogradeJob.ST_PENDING]
+    reserved = Course.objects.aggregate(total=Sum('reserved_workers'))['total'] or 0
+    order = pick_jobs(pending, len(pending) + reserved, estimates, now)
+    for position, job in enumerate(order, 1):
+        finish = heapq.heappop(free_at) + expected(job)
+        heapq.heappush(free_at, finish)
+        add(job, position, finish)
+
+    return {rid: (position, now + timedelta(seconds=finish)) for rid, (position, finish) in queue.items()}
+
+
+def add_queue_info(subs):
+    """
+    Sets queue_position and queue_eta (see estimate_queue) on each submission
+    still waiting for the autograder
+    """
+    subs = [s for s in subs if s.status in (s.CH_TO_AUTOGRADE, s.CH_PREVIOUS) and hasattr(s, 'autograderresult')]
+    if not subs:
+        return
+
+    queue = estimate_queue()
+    for sub in subs:
+        if sub.autograderresult.id in queue:
+            sub.queue_position, sub.queue_eta = queue[sub.autograderresult.id]
+
+
+def get_timeout(job):
+    """
+    Returns the seconds django-q gives a job's task before killing it
+    """
+    #Give the run time to be killed by its own limits before django-q steps in,
+    #plus time to build the autograder's dependency cache on its first run
+    timeout = job.assignment.get_limits()['wall_timeout'] + 60
+    if autograder_cache.needs_deps_build(job.autograder_hash):
+        timeout += settings.AUTOGRADER_DEPS_TIMEOUT
+    return timeout
+
+
+def _enqueue(job):
+    """
+    Hands a job to the django-q cluster and returns the task id
+    """
+    return async_task('grader.tasks.run_autograde_job', job.id,
+                      hook='grader.tasks.autograde_complete', timeout=get_timeout(job),
+                      task_name=TASK_NAME_PREFIX + str(job.id))
+
+
+def get_shard_dir(sub, shard_index):
+    """
+    Returns the directory a shard of a sharded autograder leaves its results in
+    """
+    shard_dir = sub.get_directory(subdir=sub.SHARD_DIR) / str(shard_index)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    return shard_dir
+
+
+def get_task_job(task):
+    """
+    Returns the job a finished django-q task ran, or None if it wasn't an autograder job
+    """
+    if not (task.name or '').startswith(TASK_NAME_PREFIX):
+        return None
+    return AutogradeJob.objects.filter(id=int(task.name[len(TASK_NAME_PREFIX):])).first()
+
+
+def finish(job):
+    """
+    Marks a job as done, saving its exit status, and records its run time
+    Call dispatch() afterwards to hand its worker to the next job
+    Returns the run time in seconds, or None if the job never started
+    """
+    job.state = AutogradeJob.ST_DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=['state', 'finished_at', 'returncode', 'killed_by', 'deps_cache'])
+
+    run_time = None
+    if job.started_at:
+        run_time = (job.finished_at - job.started_at).total_seconds()
+        RuntimeEstimate.record(job.assignment_id, job.autograder_hash, run_time)
+
+    return run_time
+
@@ -1,36 +1,416 @@
-from django_q.tasks import async_task, result
 from django.conf import settings
+from django.db import transaction
 from grader.models import AutograderResult
-import json, subprocess
+import json, subprocess, hashlib, shutil, os, time, traceback, itertools
 
 from pathlib import Path
 
-from grader.models import Submission, Assignment
+from grader.models import Submission, Assignment, AutogradeJob, TestResult
+from grader import autograder_cache, scheduler, regrade, metrics, sandbox, workspace, remote, lease
+
+# Most bytes of phase timings read back from autograde.sh
+TIMINGS_MAX_SIZE = 4096
+
+# TestResults created per insert
+TESTS_BATCH_SIZE = 500
+
+
+def run_autograde_job(job_id):
+    """
+    Runs one autograder job on a worker
+    The autograde script's output is streamed straight into the submission's
+    autograder log instead of being held in memory, and only a small status
+    dict is returned (and stored by django-q) for autograde_complete
+    Returns None without running anything if the job is already done or
+    another attempt at it is still running, see grader/lease.py
+    """
+    job = lease.claim(job_id)
+    if not job:
+        return None
+    sub = job.result.submission
+    base = workspace.get_job_dir(job)
+
+    # Shards each get their own working directory and results directory,
+    # and are merged into the reports directory once all have finished
+    extra_env = dict()
+    if job.shard_count > 1:
+        extra_env['ATHENA_SHARD_INDEX'] = str(job.shard_index)
+        extra_env['ATHENA_SHARD_COUNT'] = str(job.shard_count)
+
+    # Workers on other hosts fetch the zips by hash, and use a local results
+    # directory and log that are pushed to the web host once the run is over
+    if remote.is_remote():
+        autograder_zip = remote.fetch_artifact(job.autograder_hash)
+        submission_zip = remote.fetch_artifact(job.submission_hash)
+        results_dir = base.with_name(base.name + '.results')
+        script_out = base.with_name(base.name + '.log')
+        shutil.rmtree(results_dir, ignore_errors=True)
+        results_dir.mkdir(parents=True)
+        script_out.unlink(missing_ok=True)
+    else:
+        autograder_zip = job.autograder_zip
+        submission_zip = job.submission_zip
+        results_dir = get_staging_dir(job, job.attempt)
+        script_out = sub.get_autograde_output_log()
+        # Earlier attempts have lost their lease, so their results are never used
+        for old in results_dir.parent.glob(get_results_dir(job).name + '.attempt-*'):
+            shutil.rmtree(old, ignore_errors=True)
+
+    # Timings are kept outside the working directory, out of reach of the autograder
+    timings_file = base.with_name(base.name + '.timings')
+    timings_file.unlink(missing_ok=True)
+
+    # Small runs work in RAM if the budget allows; the files kept beside the
+    # working directory stay on disk either way
+    work_dir, ram_slot = workspace.make_job_dir(job, (autograder_zip, submission_zip))
+
+    # The cache entry, deps included, is kept from eviction until the run is over
+    autograder_tree, cache_lock = autograder_cache.use_extracted(autograder_zip)
+
+    print(f'Running: {settings.AUTOGRADE_SCRIPT}, {work_dir}, {autograder_tree}, {submission_zip}, {results_dir}')
+    print(f'Log at {script_out}')
+
+    limits = job.assignment.get_limits()
+    heartbeat = lease.Heartbeat(job)
+    heartbeat.start()
+    try:
+        with open(script_out, 'ab') as log:
+            log.write(b'=== Attempt %d ===\n' % job.attempt)
+            log.flush()
+            # The first run of an autograder version builds its dependency
+            # cache, with more time than a normal run
+            deps_limits = dict(limits,
+                               wall_timeout=max(limits['wall_timeout'], settings.AUTOGRADER_DEPS_TIMEOUT),
+                               cpu_timeout=max(limits['cpu_timeout'], settings.AUTOGRADER_DEPS_TIMEOUT))
+            build_start = time.monotonic()
+            deps_dir, built = autograder_cache.get_deps(autograder_tree, deps_limits, log)
+            build_time = time.monotonic() - build_start
+            if deps_dir:
+                extra_env['ATHENA_DEPS_DIR'] = str(deps_dir)
+
+            proc = sandbox.run_limited([
+                settings.AUTOGRADE_SCRIPT,
+                work_dir,
+                autograder_tree,
+                submission_zip,
+                results_dir,
+                script_out,
+                timings_file,
+            ], limits, extra_env, should_stop=heartbeat.lost.is_set, stdout=log, stderr=subprocess.STDOUT)
+    finally:
+        heartbeat.stop()
+        cache_lock.close()
+        # Leave deleting the working directory to the collector
+        workspace.discard(work_dir, ram_slot)
+
+    # Another attempt has taken over the job, so this one leaves no results
+    if heartbeat.lost.is_set():
+        shutil.rmtree(results_dir, ignore_errors=True)
+        timings_file.unlink(missing_ok=True)
+        return None
+
+    phases = list()
+    if built:
+        phases.append(('deps', build_time))
+    if timings_file.exists():
+        with open(timings_file, 'r') as f:
+            phases += metrics.parse_phases(f.read(TIMINGS_MAX_SIZE))
+        timings_file.unlink()
+
+    # A run that had to build the dependency cache counts as a miss
+    if built:
+        deps_cache = AutogradeJob.DEPS_MISS
+    elif deps_dir:
+        deps_cache = AutogradeJob.DEPS_HIT
+    else:
+        deps_cache = ''
+
+    status = {'job': job.id, 'attempt': job.attempt, 'returncode': proc.returncode,
+              'killed_by': proc.killed_by, 'phases': phases, 'deps_cache': deps_cache}
+
+    # The web host completes the job when a remote worker pushes its results
+    if remote.is_remote():
+        try:
+            remote.push_results(job, status, results_dir, script_out)
+        finally:
+            shutil.rmtree(results_dir, ignore_errors=True)
+            script_out.unlink(missing_ok=True)
+
+    return status
+
+
+def get_results_dir(job):
+    """
+    Returns the directory a job leaves its results in on the web host
+    """
+    if job.shard_count > 1:
+        return scheduler.get_shard_dir(job.result.submission, job.shard_index)
+    return Path(job.result.result_dir)
+
+
+def get_staging_dir(job, attempt):
+    """
+    Returns the directory an attempt at a job leaves its results in on the web
+    host, beside the job's results directory so they can be renamed into it
+    """
+    results_dir = get_results_dir(job)
+    return results_dir.with_name('%s.attempt-%d' % (results_dir.name, attempt))
+
+
+def install_results(job, attempt):
+    """
+    Moves the results of an attempt into the job's results directory
+    Each file is renamed into place, replacing the previous one in one step
+    """
+    staging = get_staging_dir(job, attempt)
+    if not staging.exists():
+        return
+    results_dir = get_results_dir(job)
+    results_dir.mkdir(parents=True, exist_ok=True)
+    for entry in staging.iterdir():
+        dest = results_dir / entry.name
+        if dest.is_dir() and not dest.is_symlink():
+            shutil.rmtree(dest)
+        os.replace(entry, dest)
+    shutil.rmtree(staging, ignore_errors=True)
+
 
 def autograde_complete(task):
     print(f'{task}, {task.result}')
-    agid = int(task.result.args[-1])
-    ag_res = AutograderResult.objects.get(pk=agid)
+    job = scheduler.get_task_job(task)
+    if not job:
+        return
+
+    # A duplicate delivery of the task that found the job taken, see grader/lease.py
+    if task.success and task.result is None:
+        return
+
+    complete_job(job, task.result if task.success else None)
+
+
+def finish_attempt(job, status):
+    """
+    Marks a job done with the outcome of its current attempt
+    status is as for complete_job
+    Returns (AutograderResult, every job of the result), or None if the job
+    was already done or status is from an earlier attempt
+    """
+
+    # Mark the job done with its result locked, so exactly one of the shards
+    # of a sharded autograder sees that every shard has finished
+    with transaction.atomic():
+        ag_res = AutograderResult.objects.select_for_update().get(id=job.result_id)
+        job.refresh_from_db()
+        if job.state == AutogradeJob.ST_DONE:
+            return None
+
+        # An attempt that lost its lease to a later one leaves no trace
+        if status and status['attempt'] != job.attempt:
+            return None
+
+        # Record how this run ended
+        if status:
+            install_results(job, status['attempt'])
+            job.returncode = status['returncode']
+            job.killed_by = status['killed_by']
+            job.deps_cache = status['deps_cache']
+        scheduler.finish(job)
+        return ag_res, list(ag_res.autogradejob_set.all())
+
+
+def complete_job(job, status):
+    """
+    Records how an autograder job ended, and fills in its result once every
+    shard of the autograder has finished
+    status is the dict returned by run_autograde_job, or None if the task failed
+    Does nothing if the job was already completed, e.g. by a remote worker
+    pushing its results before its task's hook ran
+    """
+
+    # A job left running would hold its worker's slot until the cluster
+    # restarts, so one whose results can't be installed counts as failed
+    try:
+        finished = finish_attempt(job, status)
+    except Exception:
+        traceback.print_exc()
+        status = None
+        finished = finish_attempt(job, None)
+    if not finished:
+        return
+    ag_res, jobs = finished
+
+    # Record how long each phase of the run took
+    metrics.record(job, status['phases'] if status else None)
+
+    if any(j.state != AutogradeJob.ST_DONE for j in jobs):
+        scheduler.dispatch()
+        return
+
     print(f'{ag_res}')
     submission = ag_res.submission
-    submission.status = Submission.CH_AUTOGRADED
 
-    if not task.success:
-        ag_res.score = 0
-        ag_res.autograde_success = False
-    else:
+    # Don't replace a manual grade, or mark a superseded submission as current
+    if submission.status in (Submission.CH_TO_AUTOGRADE, Submission.CH_SUBMITTED):
+        submission.status = Submission.CH_AUTOGRADED
+
+    # Failure is a non-zero exit code from any shard, a run killed by its
+    # limits, or a missing or unreadable results.json
+    ag_res.score = 0
+    ag_res.autograde_success = False
+    ag_res.killed_by = next((j.killed_by for j in jobs if j.killed_by), '')
+
+    results = None
+    if all(j.returncode == 0 for j in jobs):
         results_json_file = submission.get_report_dir() / Submission.RESULTS_FILENAME
-        with open(results_json_file, 'r') as f:
-            results = json.load(f)
-        print(results)
+        try:
+            if len(jobs) > 1:
+                results = merge_shards(submission, len(jobs))
+            else:
+                results = read_results(results_json_file)
 
-        ag_res.score = results['score']
-        ag_res.autograde_success = True
+            ag_res.score = float(results['score'])
+            ag_res.autograde_success = True
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            print(f'Could not read {results_json_file}: {e}')
+            results = None
     
+    submission.save()
+
+    # A sharded run takes as long as its slowest shard
+    run_times = [(j.finished_at - j.started_at).total_seconds() for j in jobs if j.started_at]
+    ag_res.run_time = max(run_times) if run_times else None
+
+    ag_res.save()
+
+    # Store each test so they can be queried across the assignment
+    if results:
+        save_tests(TestResult.from_results(ag_res, results))
+
+    # Feed the next submission in if this run was part of a regrade
+    regrade.item_done(submission)
+
+    # Hand the freed worker to the next job
+    scheduler.dispatch()
+
+
+def merge_shards(sub, shard_count):
+    """
+    Merges the results of every shard of a sharded autograder into the reports directory
+    Scores are summed and outputs and tests concatenated into one results.json;
+    any other files a shard left are moved to shard-<n>/
+    Returns the merged results
+    """
+    reports_dir = sub.get_report_dir()
+    merged = None
+
+    for i in range(shard_count):
+        shard_dir = scheduler.get_shard_dir(sub, i)
+        results = read_results(shard_dir / Submission.RESULTS_FILENAME)
+
+        if merged is None:
+            merged = dict(results, score=0, output='', tests=[])
+        # Read the same way as an unsharded results.json; tests that aren't a list are left out
+        merged['score'] += float(results['score'])
+        if results.get('output'):
+            merged['output'] += '=== Shard %d ===\n%s\n' % (i, results['output'])
+        if isinstance(results.get('tests'), list):
+            merged['tests'] += results['tests']
+
+        os.remove(shard_dir / Submission.RESULTS_FILENAME)
+        if os.listdir(shard_dir):
+            shard_reports = reports_dir / ('shard-%d' % i)
+            shutil.rmtree(shard_reports, ignore_errors=True)
+            shutil.move(str(shard_dir), shard_reports)
+
+    with open(reports_dir / Submission.RESULTS_FILENAME, 'w') as f:
+        json.dump(merged, f)
+
+    shutil.rmtree(sub.get_directory(subdir=Submission.SHARD_DIR), ignore_errors=True)
+
+    return merged
+
+
+def read_results(path):
+    """
+    Returns the contents of a results.json
+    Reads at most AUTOGRADER_RESULTS_MAX_SIZE bytes, so a runaway autograder
+    can't exhaust the memory of whoever reads it. The file is parsed whole
+    rather than streamed: the cap already bounds the memory it takes, and
+    shards' results are merged whole anyway (see merge_shards)
+    Raises OSError if the file can't be read or is too large, and ValueError
+    if it isn't a JSON object
+    """
+    max_size = settings.AUTOGRADER_RESULTS_MAX_SIZE
+    with open(path, 'rb') as f:
+        data = f.read(max_size + 1)
+    if len(data) > max_size:
+        raise OSError(f'{path} is larger than {max_size} bytes')
+
+    results = json.loads(data)
+    if not isinstance(results, dict):
+        raise ValueError(f'{path} is not a JSON object')
+    return results
+
+
+def save_tests(tests):
+    """
+    Saves TestResults TESTS_BATCH_SIZE at a time, so only one batch of them
+    is held in memory
+    """
+    tests = iter(tests)
+    while True:
+        batch = list(itertools.islice(tests, TESTS_BATCH_SIZE))
+        if not batch:
+            break
+        TestResult.objects.bulk_create(batch)
+
+
+def get_input_hash(submission_zip, autograder_zip):
+    """
+    Returns a hash identifying a submission zip together with an autograder zip
+    """
+    digest = hashlib.sha256()
+    digest.update(autograder_cache.hash_file(submission_zip).encode())
+    digest.update(autograder_cache.hash_file(autograder_zip).encode())
+    return digest.hexdigest()
+
+
+def clone_autograde_result(prev, sub):
+    """
+    Copies the score and report artifacts of a finished result onto a submission
+    Used instead of running the autograder when the inputs are identical
+    """
+    reports_dir = sub.get_report_dir()
+    shutil.copytree(prev.submission.get_report_dir(), reports_dir, dirs_exist_ok=True)
+
+    ag_res = AutograderResult(submission=sub, result_dir=reports_dir,
+                              score=prev.score, autograde_success=True,
+                              input_hash=prev.input_hash)
     ag_res.save()
 
+    def copy_tests():
+        for t in prev.testresult_set.all().iterator(chunk_size=TESTS_BATCH_SIZE):
+            t.pk = None
+            t.result = ag_res
+            t.assignment_id = sub.assignment_id
+            yield t
+    save_tests(copy_tests())
 
-def autograde_submission(sub, subzip):
+    sub.status = Submission.CH_AUTOGRADED
+    sub.save()
+
+    return ag_res
+
+
+def autograde_submission(sub, subzip, force=False):
+    """
+    Queues a submission to be run through its assignment's autograder
+    If an identical submission was already autograded successfully with the
+    same autograder, its result is cloned instead, unless force is set or
+    the assignment always reruns the autograder
+
+    Returns list of queued AutogradeJobs (one per shard), or None if no job was queued
+    """
     asgn = sub.assignment
 
     if not subzip or asgn.autograde_mode != Assignment.AUTOGRADE:
@@ -43,6 +423,16 @@ def autograde_submission(sub, subzip):
     if not autograder_zip:
         return
 
+    # Reuse a finished result for identical inputs rather than rerunning
+    input_hash = get_input_hash(submission_zip, autograder_zip)
+    if not (force or asgn.autograde_force_rerun):
+        prev = (AutograderResult.objects.filter(input_hash=input_hash, autograde_success=True)
+                .order_by('-id').first())
+        if prev:
+            print(f'Reusing {prev} for {sub}')
+            clone_autograde_result(prev, sub)
+            return None
+
     # Here's what we need to do to autograde an assignment:
     # 1. Find a nice safe space for us to work in. Ideally, this is a docker
     #    container, a chroot environment, etc, but for now just
@@ -52,8 +442,10 @@ def autograde_submission(sub, subzip):
     #     - Path to autograder zip
     #     - Path to submission zip
     #     - Path to submission reports directory
+    #     The autograder zip is extracted once into the autograder cache and
+    #     the script is handed the cached tree instead of the zip.
     #     It will:
-    #     - Unzip the autograder there
+    #     - Hardlink the cached autograder tree there
     #     - Run the `run_autograder` script
     #     - The script will run everything and leave output at <base>/output/
     #     - The output directory MUST contain a `results.json` file
@@ -63,8 +455,8 @@ def autograde_submission(sub, subzip):
     # 4. Update grade in DB, update submission state
 
     # Step 1: Find a nice safe space to work in
-    base = Path('/tmp/athena-autograder') / str(sub.id)
-    base.mkdir(parents=True, exist_ok=True) # Make sure it exists
+    # The working directory is created when the job is dispatched, see
+    # grader.scheduler
 
     # Create reports directory if it doesn't already exist
     reports_dir = sub.get_report_dir()
@@ -74,23 +466,30 @@ def autograde_submission(sub, subzip):
         f = open(script_out, 'w')
         f.close()
 
-    # Create autograde result now
-    ag_res = AutograderResult(submission=sub, result_dir=reports_dir, autograde_success=False)
-    ag_res.save()
+    # Extract the autograder into the cache if this version hasn't been seen
+    autograder_tree = autograder_cache.get_extracted(autograder_zip)
 
-    print(f'Running: {settings.AUTOGRADE_SCRIPT}, {base}, {autograder_zip}, {submission_zip}, {reports_dir}')
-    print(f'Log at {script_out}')
+    # The autograder may ask to be split into shards run in parallel
+    try:
+        shards = int(autograder_cache.read_manifest(autograder_tree).get('shards', 1))
+    except (TypeError, ValueError):
+        shards = 1
+    shards = min(max(shards, 1), settings.AUTOGRADER_MAX_SHARDS)
 
-    # Step 2: hand off to autograde script
-    tid = async_task('subprocess.run', [
-        settings.AUTOGRADE_SCRIPT,
-        base,
-        autograder_zip,
-        submission_zip,
-        reports_dir,
-        script_out,
-        str(ag_res.id),
-    ], capture_output=True, hook='grader.tasks.autograde_complete')
+    # Create autograde result now
+    ag_res = AutograderResult(submission=sub, result_dir=reports_dir, autograde_success=False,
+                              input_hash=input_hash)
+    ag_res.save()
 
+    # Step 2: queue a job per shard, the scheduler hands each to the
+    # autograde script once a worker is free for this course
+    shutil.rmtree(sub.get_directory(subdir=Submission.SHARD_DIR), ignore_errors=True)
+    jobs = [AutogradeJob(result=ag_res, course=asgn.course, assignment=asgn,
+                         submission_zip=submission_zip, autograder_zip=autograder_zip,
+                         autograder_hash=autograder_cache.hash_file(autograder_zip),
+                         submission_hash=autograder_cache.hash_file(submission_zip),
+                         shard_index=i, shard_count=shards)
+            for i in range(shards)]
+    scheduler.submit(*jobs)
 
-    return tid
+    return jobs
@@ -1,4 +1,6 @@
 from django import template
+from django.utils import timezone
+from django.utils.formats import time_format
 from grader.models import Submission
 
 register = template.Library()
@@ -27,3 +29,18 @@ def submission_status(sub, is_student):
         
 register.filter('submission_status', submission_status)
 
+
+
+@register.filter
+def queue_status(sub):
+    """
+    Returns where a submission is in the autograder queue and when it should be done
+    Empty unless grader.scheduler.add_queue_info found it waiting
+    """
+    if getattr(sub, 'queue_position', None) is None:
+        return ""
+
+    eta = time_format(timezone.localtime(sub.queue_eta))
+    if sub.queue_position == 0:
+        return "Running, expected by %s" % eta
+    return "#%d in queue, expected by %s" % (sub.queue_position, eta)
@@ -1,3 +1,783 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.contrib.auth.models import User, Group, AnonymousUser
+from django.core.cache import caches
+from django.urls import reverse
+from django.utils import timezone
+from django.db import OperationalError
+from datetime import timedelta
+from unittest import mock
+from pathlib import Path
+import io
+import os
+import stat
+import tempfile
+import zipfile
 
-# Create your tests here.
+from grader.forms import zip_validator
+from grader.models import Course, Assignment, Submission, AutograderResult, AutogradeJob, Grade, TestResult, \
+    load_user_groups
+from grader import autograder_cache, lease, regrade, roles, scheduler, tasks
+import json
+
+
+class PageQueryCountTests(TestCase):
+    """
+    Pins the number of SQL queries the course, assignment and submissions
+    pages make, which must not grow with the number of assignments or
+    submissions shown
+    """
+
+    def setUp(self):
+        caches[settings.ROLE_CACHE].clear()
+        self.instructor = User.objects.create_user('instructor')
+        self.student = User.objects.create_user('student')
+        self.course = Course.objects.create(code='CSCI120', section=1, title='Intro')
+        self.course.instructors.add(self.instructor)
+        self.course.students.add(self.student)
+        self.assgn = self.add_assignment('HW0')
+        self.add_submissions(self.assgn, [self.student], 1)
+
+    def add_assignment(self, code):
+        return Assignment.objects.create(course=self.course, code=code, title=code,
+                                         due_date=timezone.now() + timedelta(days=7))
+
+    def add_submissions(self, assgn, students, count):
+        """
+        Makes count submissions from each student, all but the last of them
+        previous, with an autograder result and the last one graded
+        """
+        for student in students:
+            for i in range(count):
+                sub = Submission.objects.create(assignment=assgn, student=student,
+                                                status=Submission.CH_PREVIOUS if i < count - 1
+                                                else Submission.CH_AUTOGRADED)
+                AutograderResult.objects.create(submission=sub, score=i, autograde_success=True)
+            Grade.objects.create(submission=sub, grader=self.instructor, grade=count)
+
+    def add_more(self):
+        """
+        Adds assignments, students and resubmissions
+        """
+        students = [User.objects.create_user('student%d' % i) for i in range(5)]
+        self.course.students.add(*students)
+        for i in range(5):
+            self.add_submissions(self.add_assignment('HW%d' % (i + 1)), [self.student] + students, 3)
+        self.add_submissions(self.assgn, students, 4)
+
+    def assertFlatQueries(self, num, user, url):
+        """
+        Checks that a page takes num queries, before and after add_more(),
+        with the user's course roles not yet cached
+        """
+        self.client.force_login(user)
+        with self.assertNumQueries(num):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.add_more()
+        caches[settings.ROLE_CACHE].clear()
+        with self.assertNumQueries(num):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_course_instructor(self):
+        self.assertFlatQueries(11, self.instructor, reverse('grader:course', args=(self.course.id,)))
+
+    def test_course_student(self):
+        self.assertFlatQueries(9, self.student, reverse('grader:course', args=(self.course.id,)))
+
+    def test_assignment_instructor(self):
+        self.assertFlatQueries(4, self.instructor, reverse('grader:assignment', args=(self.assgn.id,)))
+
+    def test_assignment_student(self):
+        self.assertFlatQueries(5, self.student, reverse('grader:assignment', args=(self.assgn.id,)))
+
+    def test_submissions_instructor(self):
+        self.assertFlatQueries(6, self.instructor,
+                               reverse('grader:submissions', args=(self.assgn.id, self.student.id)))
+
+    def test_submissions_student(self):
+        self.assertFlatQueries(6, self.student,
+                               reverse('grader:submissions', args=(self.assgn.id, self.student.id)))
+
+    def test_latest_submissions(self):
+        self.add_more()
+        latest = list(Submission.get_latest(self.assgn))
+        self.assertEqual(sorted(s.student.username for s in latest),
+                         ['student'] + ['student%d' % i for i in range(5)])
+        self.assertTrue(all(s.status == Submission.CH_AUTOGRADED for s in latest))
+        self.assertEqual([s.sub_date for s in latest], sorted((s.sub_date for s in latest), reverse=True))
+
+    def test_submission_table(self):
+        self.assertFlatQueries(5, self.instructor, reverse('grader:submission_table', args=(self.assgn.id,)))
+
+    def test_submission_table_pages(self):
+        self.add_more()
+        students = [User.objects.create_user('paged%d' % i) for i in range(60)]
+        self.course.students.add(*students)
+        self.add_submissions(self.assgn, students, 1)
+        self.client.force_login(self.instructor)
+        url = reverse('grader:submission_table', args=(self.assgn.id,))
+
+        for sort in ('-date', 'date', 'student', '-student'):
+            page = self.client.get(url, {'sort': sort}).json()
+            self.assertEqual(page['count'], 66)
+            rows = page['submissions']
+            while page['after']:
+                #Course roles are cached by now
+                with self.assertNumQueries(4):
+                    page = self.client.get(url, {'sort': sort, 'after': page['after']}).json()
+                self.assertNotIn('count', page)
+                rows += page['submissions']
+            self.assertEqual(sorted(r['id'] for r in rows), sorted(s.id for s in Submission.get_latest(self.assgn)))
+
+        rows = self.client.get(url, {'sort': 'student'}).json()['submissions']
+        self.assertEqual(rows[0]['student'], 'paged0')
+        self.assertEqual(self.client.get(url, {'graded': 'no'}).json()['count'], 0)
+        self.assertEqual(self.client.get(url, {'min_score': 3}).json()['count'], 5)
+        self.assertEqual(self.client.get(url, {'max_score': 0, 'status': Submission.CH_AUTOGRADED}).json()['count'], 61)
+        self.assertEqual(self.client.get(url, {'after': 'nonsense'}).status_code, 400)
+
+    def test_bulk_action_on_filter(self):
+        self.add_more()
+        self.client.force_login(self.instructor)
+        self.client.post(reverse('grader:assignment', args=(self.assgn.id,)),
+                         {'action': 'hide_reports', 'target': 'filter', 'min_score': 3})
+        hidden = AutograderResult.objects.filter(visible=False)
+        self.assertEqual(hidden.count(), 5)
+        self.assertTrue(all(r.submission.assignment == self.assgn for r in hidden))
+
+
+class ZipValidatorTests(SimpleTestCase):
+    """
+    Checks that submission zips over their limits, or that would unzip
+    outside the submission directory, are turned away
+    """
+
+    LIMITS = {'max_files': 10, 'max_size': 1024 * 1024, 'max_ratio': 100}
+
+    def make_zip(self, files, compression=zipfile.ZIP_STORED):
+        """
+        Returns an upload of a zip of files, given as (ZipInfo or name, contents)
+        """
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w', compression) as z:
+            for name, data in files:
+                z.writestr(name, data)
+        return SimpleUploadedFile('sub.zip', buf.getvalue())
+
+    def assertRejected(self, f, message):
+        with self.assertRaisesMessage(ValidationError, message):
+            zip_validator(f, self.LIMITS)
+
+    def test_valid(self):
+        f = self.make_zip([('solution.py', 'print(1)'), ('lib/util.py', '')])
+        zip_validator(f, self.LIMITS)
+        self.assertEqual(f.tell(), 0)
+
+    def test_not_zip(self):
+        self.assertRejected(SimpleUploadedFile('sub.zip', b'not a zip'), 'not a valid zip')
+
+    def test_files(self):
+        f = self.make_zip([('f%d' % i, '') for i in range(11)])
+        #Turned away by the end record, before the directory is parsed
+        with mock.patch('grader.forms.zipfile.ZipFile') as parse:
+            self.assertRejected(f, 'contains 11 files')
+        parse.assert_not_called()
+
+    def test_directory_size(self):
+        self.assertRejected(self.make_zip([('f' * 4000 + str(i), '') for i in range(5)]), 'directory is larger')
+
+    def test_size(self):
+        self.assertRejected(self.make_zip([('big', os.urandom(1024 * 1024 + 1))]), 'unzips to')
+
+    def test_ratio(self):
+        self.assertRejected(self.make_zip([('zeros', bytes(512 * 1024))], zipfile.ZIP_DEFLATED), 'compressed more than')
+
+    def test_paths(self):
+        for name in ('../escape.py', 'a/../../escape.py', '/etc/passwd', '\\windows', 'C:/escape.py'):
+            self.assertRejected(self.make_zip([(name, '')]), 'outside the submission directory')
+
+    def test_symlink(self):
+        link = zipfile.ZipInfo('link')
+        link.external_attr = (stat.S_IFLNK | 0o777) << 16
+        self.assertRejected(self.make_zip([(link, '/etc/passwd')]), 'outside the submission directory')
+
+
+class RoleCacheTests(TestCase):
+    """
+    Checks that course roles are loaded in one query, cached, and reloaded
+    once a roster or the user's groups change
+    """
+
+    def setUp(self):
+        caches[settings.ROLE_CACHE].clear()
+        self.user = User.objects.create_user('user')
+        self.course = Course.objects.create(code='CSCI120', section=1, title='Intro')
+        self.other = Course.objects.create(code='CSCI160', section=1, title='Data Structures')
+
+    def get_user(self):
+        """
+        Returns a fresh copy of the user, as each request gets
+        """
+        return User.objects.get(id=self.user.id)
+
+    def test_cached(self):
+        self.course.students.add(self.user)
+        self.other.tas.add(self.user)
+
+        user = self.get_user()
+        with self.assertNumQueries(1):
+            self.assertTrue(self.course.has_student(user))
+            self.assertFalse(self.course.has_ta(user))
+            self.assertTrue(self.other.has_ta(user))
+            self.assertFalse(self.other.has_instructor(user))
+            load_user_groups(user)
+            self.assertFalse(user.is_faculty)
+
+        #A later request's user comes with no roles, which are now cached
+        with self.assertNumQueries(0):
+            self.assertTrue(self.course.has_student(User(id=self.user.id)))
+
+    def test_anonymous(self):
+        self.course.students.add(self.user)
+        with self.assertNumQueries(0):
+            self.assertFalse(self.course.has_student(AnonymousUser()))
+            self.assertFalse(self.course.has_instructor(AnonymousUser()))
+            self.assertFalse(self.course.has_ta(AnonymousUser()))
+
+    def test_roster_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.students.add(self.user)
+        self.assertTrue(self.course.has_student(self.get_user()))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.students.remove(self.course)
+        self.assertFalse(self.course.has_student(self.get_user()))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.instructors.add(self.user)
+        self.assertTrue(self.course.has_instructor(self.get_user()))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.instructors.clear()
+        self.assertFalse(self.course.has_instructor(self.get_user()))
+
+    def test_group_changes(self):
+        faculty = Group.objects.create(name=roles.FACULTY_GROUP)
+        user = self.get_user()
+        load_user_groups(user)
+        self.assertFalse(user.is_faculty)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            faculty.user_set.add(self.user)
+        user = self.get_user()
+        load_user_groups(user)
+        self.assertTrue(user.is_faculty)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.clear()
+        user = self.get_user()
+        load_user_groups(user)
+        self.assertFalse(user.is_faculty)
+
+
+class AutograderCacheTests(TestCase):
+    """
+    Checks that cache entries in use by a run are not evicted
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        override = override_settings(AUTOGRADER_CACHE_DIR=Path(self.tmp.name) / 'cache', AUTOGRADER_CACHE_MAX_SIZE=1)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def make_zip(self, name):
+        path = Path(self.tmp.name) / name
+        with zipfile.ZipFile(path, 'w') as z:
+            z.writestr('run_autograder', name)
+        return path
+
+    def test_in_use(self):
+        tree, lock = autograder_cache.use_extracted(self.make_zip('a.zip'))
+        other = autograder_cache.get_extracted(self.make_zip('b.zip'))
+        self.assertTrue(tree.exists())
+
+        #Once released, the older entry is the first to go
+        lock.close()
+        autograder_cache.get_extracted(self.make_zip('c.zip'))
+        self.assertFalse(tree.exists())
+        self.assertFalse(other.exists())
+
+
+class DepsCacheTests(TestCase):
+    """
+    Checks that an autograder's setup script builds its dependency cache once
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        override = override_settings(AUTOGRADER_CACHE_DIR=Path(self.tmp.name) / 'cache')
+        override.enable()
+        self.addCleanup(override.disable)
+        self.limits = {'cpu_quota': 1, 'memory_limit': 1024, 'pids_limit': 64,
+                       'wall_timeout': 60, 'cpu_timeout': 60}
+        self.log = tempfile.TemporaryFile()
+        self.addCleanup(self.log.close)
+
+    def make_zip(self, script):
+        path = Path(self.tmp.name) / 'autograder.zip'
+        with zipfile.ZipFile(path, 'w') as z:
+            z.writestr('requirements.txt', 'left-pad==1.0\n')
+            z.writestr(autograder_cache.SETUP_SCRIPT, script)
+        return path
+
+    def test_reads_tree(self):
+        tree = autograder_cache.get_extracted(self.make_zip('cp requirements.txt "$ATHENA_DEPS_DIR/"\n'))
+        deps, built = autograder_cache.get_deps(tree, self.limits, self.log)
+        self.assertTrue(built)
+        self.assertEqual((deps / 'requirements.txt').read_text(), 'left-pad==1.0\n')
+        self.assertEqual(autograder_cache.get_deps(tree, self.limits, self.log), (deps, False))
+
+    def test_read_only(self):
+        tree = autograder_cache.get_extracted(self.make_zip('mkdir "$ATHENA_DEPS_DIR/venv"\n'
+                                                           'touch "$ATHENA_DEPS_DIR/venv/python"\n'))
+        deps, built = autograder_cache.get_deps(tree, self.limits, self.log)
+        for path in (deps, deps / 'venv', deps / 'venv' / 'python'):
+            self.assertFalse(os.stat(path).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+    def test_failed(self):
+        tree = autograder_cache.get_extracted(self.make_zip('echo oops\nexit 1\n'))
+        self.assertEqual(autograder_cache.get_deps(tree, self.limits, self.log), (None, True))
+        self.log.seek(0)
+        self.assertEqual(self.log.read().splitlines(), [b'=== Building the dependency cache ===', b'oops',
+                                                       b'=== Building the dependency cache failed ==='])
+
+        #Later runs of the version don't try again
+        self.assertFalse(autograder_cache.needs_deps_build(tree.parent.name))
+        self.assertEqual(autograder_cache.get_deps(tree, self.limits, self.log), (None, False))
+
+    def test_in_use(self):
+        with override_settings(AUTOGRADER_CACHE_MAX_SIZE=1):
+            tree, lock = autograder_cache.use_extracted(self.make_zip('mkdir "$ATHENA_DEPS_DIR/venv"\n'))
+            deps, built = autograder_cache.get_deps(tree, self.limits, self.log)
+            with zipfile.ZipFile(Path(self.tmp.name) / 'other.zip', 'w') as z:
+                z.writestr('run_autograder', '')
+            autograder_cache.get_extracted(Path(self.tmp.name) / 'other.zip')
+            self.assertTrue((deps / 'venv').exists())
+
+            #Read-only directories are removed along with the rest of the entry
+            lock.close()
+            autograder_cache.get_extracted(self.make_zip(''))
+            self.assertFalse(deps.exists())
+
+
+class LeaseTests(TestCase):
+    """
+    Checks that a job runs at most once at a time, and that jobs left behind
+    by dead workers are requeued
+    """
+
+    def setUp(self):
+        course = Course.objects.create(code='CSCI120', section=1, title='Intro')
+        self.assgn = Assignment.objects.create(course=course, code='HW0', title='HW0',
+                                               due_date=timezone.now() + timedelta(days=7))
+        student = User.objects.create_user('student')
+        sub = Submission.objects.create(assignment=self.assgn, student=student, status=Submission.CH_TO_AUTOGRADE)
+        result = AutograderResult.objects.create(submission=sub, autograde_success=False)
+        self.job = AutogradeJob.objects.create(result=result, course=course, assignment=self.assgn,
+                                               state=AutogradeJob.ST_DISPATCHED, dispatched_at=timezone.now())
+
+    @override_settings(AUTOGRADER_LEASE_TIME=0.3)
+    def test_heartbeat_database_down(self):
+        job = lease.claim(self.job.id)
+        with mock.patch('grader.lease.renew', side_effect=OperationalError):
+            heartbeat = lease.Heartbeat(job)
+            heartbeat.start()
+            #Given up on before the lease runs out
+            self.assertTrue(heartbeat.lost.wait(0.3))
+            self.assertTrue(timezone.now() < job.lease_expires)
+            heartbeat.stop()
+
+    def test_claim(self):
+        job = lease.claim(self.job.id)
+        self.assertEqual(job.attempt, 1)
+        self.assertEqual(job.state, AutogradeJob.ST_RUNNING)
+        self.assertTrue(job.lease_expires > timezone.now())
+        self.assertEqual(job.lease_owner, lease.get_owner())
+
+        #A redelivered task doesn't run the job alongside the live attempt
+        self.assertIsNone(lease.claim(self.job.id))
+
+        #Once the lease runs out another attempt takes over, and the first can't renew
+        AutogradeJob.objects.filter(id=job.id).update(lease_expires=timezone.now() - timedelta(seconds=1))
+        second = lease.claim(self.job.id)
+        self.assertEqual(second.attempt, 2)
+        self.assertFalse(lease.renew(job))
+        self.assertTrue(lease.renew(second))
+
+        AutogradeJob.objects.filter(id=job.id).update(state=AutogradeJob.ST_DONE, lease_expires=None)
+        self.assertFalse(lease.renew(second))
+        self.assertIsNone(lease.claim(self.job.id))
+
+    def test_reclaim(self):
+        now = timezone.now()
+        result = self.job.result
+        expired = AutogradeJob.objects.create(result=result, course=self.assgn.course, assignment=self.assgn,
+                                              state=AutogradeJob.ST_RUNNING, attempt=1, lease_owner='dead:1',
+                                              lease_expires=now - timedelta(seconds=1))
+        live = AutogradeJob.objects.create(result=result, course=self.assgn.course, assignment=self.assgn,
+                                           state=AutogradeJob.ST_RUNNING, attempt=1, lease_owner='live:1',
+                                           lease_expires=now + timedelta(seconds=60))
+        lost = AutogradeJob.objects.create(result=result, course=self.assgn.course, assignment=self.assgn,
+                                           state=AutogradeJob.ST_DISPATCHED, dispatched_at=now - timedelta(days=1))
+
+        #reclaim dispatches the requeued jobs again, which would hide their state
+        with mock.patch('grader.scheduler.dispatch') as dispatch:
+            self.assertEqual(lease.reclaim(), 2)
+        dispatch.assert_called_once_with()
+        states = dict(AutogradeJob.objects.values_list('id', 'state'))
+        self.assertEqual(states[expired.id], AutogradeJob.ST_PENDING)
+        self.assertEqual(states[lost.id], AutogradeJob.ST_PENDING)
+        self.assertEqual(states[live.id], AutogradeJob.ST_RUNNING)
+        self.assertEqual(states[self.job.id], AutogradeJob.ST_DISPATCHED)
+
+        with mock.patch('grader.scheduler.dispatch') as dispatch:
+            self.assertEqual(lease.reclaim(), 0)
+        dispatch.assert_not_called()
+
+
+class PickJobsTests(TestCase):
+    """
+    Checks the order scheduler.pick_jobs dispatches jobs in
+    """
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.a = Course.objects.create(code='CSCI120', section=1, title='Intro')
+        self.b = Course.objects.create(code='CSCI160', section=1, title='Data Structures')
+
+    def make_jobs(self, course, assignment_id, count, state=AutogradeJob.ST_PENDING, waited=0, autograder_hash=''):
+        return [AutogradeJob(course_id=course.id, assignment_id=assignment_id, state=state, autograder_hash=autograder_hash,
+                             enqueued_at=self.now - timedelta(seconds=waited))
+                for i in range(count)]
+
+    def pick(self, jobs, capacity, estimates=None):
+        return scheduler.pick_jobs(jobs, capacity, estimates, self.now)
+
+    def test_weights(self):
+        self.a.autograde_weight = 2
+        self.a.save()
+        chosen = self.pick(self.make_jobs(self.a, 1, 10) + self.make_jobs(self.b, 2, 10), 6)
+        self.assertEqual(sum(j.course_id == self.a.id for j in chosen), 4)
+
+    def test_reservations(self):
+        self.b.reserved_workers = 2
+        self.b.save()
+        jobs = self.make_jobs(self.a, 1, 10)
+        self.assertEqual(len(self.pick(jobs, 3)), 1)
+        self.assertEqual(len(self.pick(jobs + self.make_jobs(self.b, 2, 1, AutogradeJob.ST_RUNNING), 3)), 1)
+        self.assertEqual(len(self.pick(jobs + self.make_jobs(self.b, 2, 2, AutogradeJob.ST_RUNNING), 3)), 1)
+
+        #A reserving course still shares what it doesn't reserve
+        chosen = self.pick(self.make_jobs(self.b, 2, 10), 3)
+        self.assertEqual(len(chosen), 3)
+
+    def test_assignments(self):
+        jobs = self.make_jobs(self.a, 1, 1, AutogradeJob.ST_RUNNING) + self.make_jobs(self.a, 1, 5, waited=60) \
+            + self.make_jobs(self.a, 2, 5)
+        chosen = self.pick(jobs, 4)
+        self.assertEqual([j.assignment_id for j in chosen].count(2), 2)
+
+    def test_shortest_first(self):
+        jobs = self.make_jobs(self.a, 1, 2, autograder_hash='long') + self.make_jobs(self.a, 1, 2, autograder_hash='short')
+        chosen = self.pick(jobs, 2, {(1, 'long'): 600, (1, 'short'): 10})
+        self.assertEqual([j.autograder_hash for j in chosen], ['short', 'short'])
+
+    def test_aging(self):
+        jobs = self.make_jobs(self.a, 1, 1, waited=6000, autograder_hash='long') \
+            + self.make_jobs(self.a, 1, 1, autograder_hash='short')
+        chosen = self.pick(jobs, 1, {(1, 'long'): 600, (1, 'short'): 10})
+        self.assertEqual(chosen[0].autograder_hash, 'long')
+
+
+class AutogradeTestCase(TestCase):
+    """
+    Base for tests of autograded submissions, kept in a scratch directory
+    Jobs are queued and dispatched, but never handed to the cluster
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        override = override_settings(SUBMISSION_DIR=Path(self.tmp.name) / 'submissions',
+                                     AUTOGRADER_CACHE_DIR=Path(self.tmp.name) / 'cache')
+        override.enable()
+        self.addCleanup(override.disable)
+        patcher = mock.patch('grader.scheduler.async_task', return_value='')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        autograder_zip = Path(self.tmp.name) / 'autograder.zip'
+        with zipfile.ZipFile(autograder_zip, 'w') as z:
+            z.writestr('run_autograder', '')
+        self.course = Course.objects.create(code='CSCI120', section=1, title='Intro')
+        self.assgn = Assignment.objects.create(course=self.course, code='HW0', title='HW0',
+                                               due_date=timezone.now() + timedelta(days=7),
+                                               autograde_mode=Assignment.AUTOGRADE,
+                                               autograder_path=str(autograder_zip))
+        self.student = User.objects.create_user('student')
+
+    def make_submission(self, contents='print(1)', student=None):
+        """
+        Saves a submission of a zip holding contents, without queueing it
+        """
+        sub = Submission.objects.create(assignment=self.assgn, student=student or self.student,
+                                        status=Submission.CH_TO_AUTOGRADE)
+        sub.set_recent()
+        sub.get_directory().mkdir(parents=True)
+        with zipfile.ZipFile(sub.get_directory() / 'sub.zip', 'w') as z:
+            z.writestr('solution.py', contents)
+        return sub
+
+    def submit(self, contents='print(1)', student=None):
+        """
+        Saves and queues a submission, returning it and its queued jobs
+        """
+        sub = self.make_submission(contents, student)
+        return sub, tasks.autograde_submission(sub, sub.get_directory() / 'sub.zip')
+
+    def finish(self, sub, score, tests=()):
+        """
+        Records a successful run of a submission, as complete_job would
+        """
+        AutogradeJob.objects.filter(result__submission=sub).update(state=AutogradeJob.ST_DONE)
+        ag_res = AutograderResult.objects.get(submission=sub)
+        ag_res.score = score
+        ag_res.autograde_success = True
+        ag_res.save()
+        (sub.get_report_dir() / Submission.RESULTS_FILENAME).write_text(json.dumps({'score': score}))
+        tasks.save_tests(TestResult.from_results(ag_res, {'tests': list(tests)}))
+        return ag_res
+
+
+class DedupTests(AutogradeTestCase):
+    """
+    Checks that identical submissions reuse a finished result instead of running again
+    """
+
+    def test_clone(self):
+        first, jobs = self.submit()
+        self.assertEqual(len(jobs), 1)
+        self.finish(first, 4, [{'name': 'a', 'score': 1, 'max_score': 1}])
+
+        sub, jobs = self.submit()
+        self.assertIsNone(jobs)
+        ag_res = AutograderResult.objects.get(submission=sub)
+        self.assertEqual((ag_res.score, ag_res.autograde_success), (4, True))
+        self.assertEqual(json.loads((sub.get_report_dir() / Submission.RESULTS_FILENAME).read_text()), {'score': 4})
+        self.assertEqual(list(ag_res.testresult_set.values_list('name', 'passed')), [('a', True)])
+        self.assertFalse(AutogradeJob.objects.filter(result=ag_res).exists())
+
+        #Different inputs, or an assignment that always reruns, get a run
+        self.assertIsNotNone(self.submit('print(2)')[1])
+        self.assgn.autograde_force_rerun = True
+        self.assgn.save()
+        self.assertIsNotNone(self.submit()[1])
+
+    def test_latest(self):
+        for score in (1, 2):
+            sub = self.make_submission()
+            tasks.autograde_submission(sub, sub.get_directory() / 'sub.zip', force=True)
+            self.finish(sub, score)
+        sub, jobs = self.submit()
+        self.assertEqual(sub.autograderresult.score, 2)
+
+    def test_reset(self):
+        first, jobs = self.submit()
+        self.finish(first, 4)
+        sub, jobs = self.submit()
+
+        #Resetting reuses the identical result, a regrade always runs
+        self.assertIsNone(regrade.rerun(sub, force=False))
+        self.assertEqual(AutograderResult.objects.get(submission=sub).score, 4)
+        self.assertIsNotNone(regrade.rerun(sub))
+
+
+class MergeShardsTests(TestCase):
+    """
+    Checks that the results of a sharded autograder are merged like a single run's
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        override = override_settings(SUBMISSION_DIR=Path(self.tmp.name))
+        override.enable()
+        self.addCleanup(override.disable)
+        course = Course.objects.create(code='CSCI120', section=1, title='Intro')
+        assgn = Assignment.objects.create(course=course, code='HW0', title='HW0',
+                                          due_date=timezone.now() + timedelta(days=7))
+        self.sub = Submission.objects.create(assignment=assgn, student=User.objects.create_user('student'))
+
+    def write_shard(self, index, results, **files):
+        shard_dir = scheduler.get_shard_dir(self.sub, index)
+        (shard_dir / Submission.RESULTS_FILENAME).write_text(json.dumps(results))
+        for name, text in files.items():
+            (shard_dir / name).write_text(text)
+
+    def test_merge(self):
+        self.write_shard(0, {'score': '5', 'output': 'first', 'tests': [{'name': 'a', 'score': 5}]})
+        self.write_shard(1, {'score': 2.5, 'tests': 'not a list'}, extra='kept')
+
+        merged = tasks.merge_shards(self.sub, 2)
+        self.assertEqual(merged['score'], 7.5)
+        self.assertEqual(merged['tests'], [{'name': 'a', 'score': 5}])
+        self.assertEqual(merged['output'], '=== Shard 0 ===\nfirst\n')
+
+        reports_dir = self.sub.get_report_dir()
+        self.assertEqual(json.loads((reports_dir / Submission.RESULTS_FILENAME).read_text()), merged)
+        self.assertEqual((reports_dir / 'shard-1' / 'extra').read_text(), 'kept')
+        self.assertFalse(self.sub.get_directory(subdir=Submission.SHARD_DIR).exists())
+
+    def test_bad_score(self):
+        self.write_shard(0, {'score': 'five'})
+        with self.assertRaises(ValueError):
+            tasks.merge_shards(self.sub, 1)
+
+
+class DispatchTests(AutogradeTestCase):
+    """
+    Checks that no more jobs are handed to the cluster than there are workers
+    """
+
+    @override_settings(AUTOGRADER_SLOTS=2)
+    def test_capacity(self):
+        for i in range(3):
+            self.submit('print(%d)' % i, User.objects.create_user('student%d' % i))
+        jobs = list(AutogradeJob.objects.order_by('id'))
+        self.assertEqual([j.state for j in jobs],
+                         [AutogradeJob.ST_DISPATCHED, AutogradeJob.ST_DISPATCHED, AutogradeJob.ST_PENDING])
+        self.assertIsNone(jobs[2].dispatched_at)
+
+        #A finished job's worker goes to the next one
+        scheduler.finish(jobs[0])
+        self.assertEqual(scheduler.dispatch(), [jobs[2]])
+        jobs[2].refresh_from_db()
+        self.assertEqual(jobs[2].state, AutogradeJob.ST_DISPATCHED)
+        self.assertTrue(jobs[2].enqueued_at <= jobs[2].dispatched_at)
+
+
+class RegradeTests(AutogradeTestCase):
+    """
+    Checks that a regrade feeds submissions to the scheduler a chunk at a time
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.subs = list()
+        for i in range(3):
+            sub, jobs = self.submit('print(%d)' % i, User.objects.create_user('student%d' % i))
+            self.finish(sub, i)
+            self.subs.append(sub)
+
+    def queued(self, batch):
+        return set(batch.regradeitem_set.filter(queued=True, done=False).values_list('submission_id', flat=True))
+
+    @override_settings(AUTOGRADER_REGRADE_CHUNK=2)
+    def test_chunks(self):
+        batch = regrade.start(self.assgn)
+        self.assertEqual(regrade.start(self.assgn), batch)
+        first = self.queued(batch)
+        self.assertEqual(len(first), 2)
+
+        #Each finished run feeds the next submission in
+        for sub in self.subs:
+            if sub.id in first:
+                self.finish(sub, 10)
+                regrade.item_done(sub)
+        self.assertEqual(len(self.queued(batch)), 1)
+        last = Submission.objects.get(id=self.queued(batch).pop())
+        self.finish(last, 10)
+        regrade.item_done(last)
+
+        batch.refresh_from_db()
+        self.assertIsNotNone(batch.finished)
+        self.assertEqual(sorted(batch.regradeitem_set.values_list('old_score', 'new_score')),
+                         [(0, 10), (1, 10), (2, 10)])
+
+    @override_settings(AUTOGRADER_REGRADE_CHUNK=1)
+    def test_nothing_to_run(self):
+        #Runs that can't be queued are recorded straight away, however many in a row
+        with mock.patch('grader.regrade.rerun', return_value=None):
+            batch = regrade.start(self.assgn)
+        batch.refresh_from_db()
+        self.assertIsNotNone(batch.finished)
+        self.assertEqual(batch.regradeitem_set.filter(done=True).count(), 3)
+
+
+class TestResultTests(AutogradeTestCase):
+    """
+    Checks reading per-test results and summarising them for an assignment
+    """
+
+    def test_from_results(self):
+        sub, jobs = self.submit()
+        ag_res = AutograderResult.objects.get(submission=sub)
+        tests = list(TestResult.from_results(ag_res, {'tests': [
+            'not a test',
+            {'name': 'a', 'score': '1', 'max_score': 2, 'status': 'passed'},
+            {'name': 'b', 'score': 2, 'max_score': 2},
+            {'number': '1.3', 'score': 'none', 'output': 'x' * (TestResult.OUTPUT_MAX_LENGTH + 10)},
+            {'name': 'd' * 300, 'score': 1, 'max_score': 2},
+        ]}))
+        self.assertEqual([t.number for t in tests], [1, 2, 3, 4])
+        self.assertEqual([t.passed for t in tests], [True, True, None, False])
+        self.assertEqual(tests[0].score, 1.0)
+        self.assertEqual(tests[2].name, '1.3')
+        self.assertIsNone(tests[2].score)
+        self.assertEqual(len(tests[2].output), TestResult.OUTPUT_MAX_LENGTH)
+        self.assertEqual(len(tests[3].name), 255)
+        self.assertEqual(list(TestResult.from_results(ag_res, {'tests': None})), [])
+
+    def test_stats(self):
+        other = User.objects.create_user('other')
+        old, jobs = self.submit('print(0)')
+        self.finish(old, 0, [{'name': 'a', 'score': 0, 'max_score': 1}] * 3)
+        sub, jobs = self.submit('print(1)')
+        self.finish(sub, 1, [{'name': 'a', 'score': 1, 'max_score': 1}, {'name': 'b', 'score': 0, 'max_score': 1}])
+        sub, jobs = self.submit('print(2)', other)
+        self.finish(sub, 2, [{'name': 'a', 'score': 1, 'max_score': 1}, {'name': 'b', 'score': 1, 'max_score': 1}])
+
+        #The replaced submission's runs aren't counted
+        self.assertEqual(list(self.assgn.get_test_stats()), [
+            {'name': 'b', 'runs': 2, 'passed': 1, 'avg_score': 0.5, 'max_score': 1.0},
+            {'name': 'a', 'runs': 2, 'passed': 2, 'avg_score': 1.0, 'max_score': 1.0},
+        ])
+
+
+class CancelSupersededTests(AutogradeTestCase):
+    """
+    Checks that resubmitting cancels the runs of a student's earlier submissions
+    """
+
+    def test_cancel(self):
+        old, old_jobs = self.submit('print(0)')
+        other, other_jobs = self.submit('print(0)', User.objects.create_user('other'))
+        sub, jobs = self.submit('print(1)')
+
+        self.assertEqual(scheduler.cancel_superseded(sub), [old])
+        self.assertFalse(AutogradeJob.objects.filter(result__submission=old).exclude(state=AutogradeJob.ST_DONE).exists())
+        ag_res = AutograderResult.objects.get(submission=old)
+        self.assertIsNotNone(ag_res.cancelled)
+        self.assertEqual(ag_res.score, 0)
+        self.assertFalse(ag_res.autograde_success)
+
+        #Neither the new submission nor another student's is touched
+        for s in (sub, other):
+            self.assertIsNone(AutograderResult.objects.get(submission=s).cancelled)
+            self.assertTrue(AutogradeJob.objects.filter(result__submission=s).exclude(state=AutogradeJob.ST_DONE).exists())
+        self.assertEqual(scheduler.cancel_superseded(sub), [])
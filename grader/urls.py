@@ -15,17 +15,28 @@ urlpatterns = [
     path('edit_assgn/<int:courseid>/<int:assgnid>'                  , views.edit_assgn,                name='edit_assgn'),
 
     path('assignment/<int:assgnid>/submissions/<int:userid>'        , views.submissions,               name='submissions'),
+    path('assignment/<int:assgnid>/regrade'                         , views.regrade_status,            name='regrade'),
+    path('assignment/<int:assgnid>/timings'                         , views.autograder_timings,        name='assgn_timings'),
+    path('assignment/<int:assgnid>/tests'                           , views.test_results,              name='assgn_tests'),
+    path('assignment/<int:assgnid>/table'                           , views.submission_table,          name='submission_table'),
     path('assignment/<int:assgnid>/<str:filename>/delete'           , file_access.assgn_file_delete,   name='assgn_file_delete'),
     path('assignment/<int:assgnid>/<str:filename>'                  , file_access.assgn_file_download, name='assgn_file_download'),
     path('assignment/<int:assgnid>'                                 , views.assignment,                name='assignment'),
 
     path('submissions/<int:subid>/download'                         , file_access.submission_download, name='submission_download'),
+    path('submissions/<int:subid>/log'                              , file_access.autograde_log,       name='autograde_log'),
     path('submissions/<int:subid>/<str:subdir>/<str:filename>/download', file_access.submission_download, name='submission_download_subdir'),
     path('submissions/<int:subid>/<str:subdir>/<str:filename>/delete', file_access.submission_download, name='submission_delete_subdir'),
 
     path('grades/<int:gradeid>/remove'                              , file_access.remove_grade,        name='remove_grade'),
     path('grades/<int:gradeid>/reset_autograde'                     , file_access.reset_autograde,     name='reset_autograde'),
 
+    path('artifacts/<str:digest>'                                   , file_access.artifact_download,   name='artifact_download'),
+    path('worker/jobs/<int:jobid>/complete'                         , file_access.job_complete,        name='job_complete'),
+
+    path('timings/'                                                 , views.autograder_timings,        name='timings'),
+    path('metrics'                                                  , views.autograder_metrics,        name='metrics'),
+
     path('login/'                                                   , views.login,                     name='login'),
     path('logout/'                                                  , views.logout,                    name='logout'),
     path(''                                                         , views.home       ,               name='home'),
@@ -1,13 +1,18 @@
 from django.shortcuts import render
 from django.http import *
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.formats import date_format
 from django.contrib.auth.models import User
+from django.db.models import Count, Prefetch
 import django.contrib.auth as auth
 
 from grader.models import *
 from grader.forms import *
 
 from grader.file_access import get_download
+from grader import regrade, metrics, scheduler
+from grader.templatetags.tags import submission_status, queue_status
 
 import re
 
@@ -121,24 +126,25 @@ def course(request, courseid):
         return render(request, 'grader/access_denied.html', params)
     
     #Load all assignments for course
-    assignments = course.assignment_set.order_by('due_date').reverse().prefetch_related('submission_set')
+    assignments = course.assignment_set.order_by('due_date').reverse()
     
     #Load student view
     if params.get('student_view'):
         
-        #Get student's most recent submission for each assignment
+        #Get student's most recent submission for each assignment, all in one query
+        recent = (Submission.objects.filter(student=request.user)
+                  .exclude(status=Submission.CH_PREVIOUS).select_related('autograderresult', 'grade'))
+        assignments = list(assignments.prefetch_related(Prefetch('submission_set', queryset=recent,
+                                                                 to_attr='recent_subs')))
         for a in assignments:
-            try:
-                a.recent = a.submission_set.exclude(status=Submission.CH_PREVIOUS).get(student=request.user)
-            except:
-                a.recent = None
+            a.recent = a.recent_subs[0] if a.recent_subs else None
     
     #Load instructor/TA view
     else:
         
-        #Get number of submissions for each assignment
-        for a in assignments:
-            a.sub_count = a.submission_set.values('student').distinct().count()
+        #Get number of students who submitted each assignment
+        assignments = assignments.annotate(sub_count=Count('submission__student', distinct=True))
+        params['num_students'] = course.students.count()
         
         #User add a file - save it and reload page
         if request.method == 'POST':
@@ -173,7 +179,7 @@ def assignment(request, assgnid):
         return login_redirect(request)
 
     #Get the assigment
-    assgn = Assignment.objects.get(id=assgnid)
+    assgn = Assignment.objects.select_related('course').get(id=assgnid)
     course = assgn.course
     submissions = assgn.submission_set.all()
     
@@ -196,7 +202,9 @@ def assignment(request, assgnid):
     if params.get('student_view', False):
         
         #Load user's submissions
-        params['prev_submissions'] = assgn.submission_set.filter(student=request.user).order_by('sub_date').reverse()
+        params['prev_submissions'] = list(assgn.submission_set.filter(student=request.user)
+                                          .select_related('autograderresult').order_by('sub_date').reverse())
+        scheduler.add_queue_info(params['prev_submissions'])
 
         #Check if student can make new submission
         if (assgn.is_past_due() and assgn.enforce_deadline):
@@ -230,10 +238,20 @@ def assignment(request, assgnid):
         #Form data was submitted
         if request.method == 'POST':
             
-            #Submissions were selected from table
-            if len(request.POST.get('submissions', [])) > 0:
-                
+            #Rerun the autograder on every current submission
+            if 'regrade' in request.POST.get('action', []) and params['instructor_view']:
+                regrade.start(assgn, request.user)
+                return HttpResponseRedirect(reverse('grader:regrade', args=(assgnid,)))
+            
+            #Submissions were selected from table, or every one matching its filter
+            if request.POST.get('target') == 'filter':
+                filter_form = SubmissionFilterForm(request.POST)
+                subids = list(filter_form.get_submissions(assgn).values_list('id', flat=True)
+                              if filter_form.is_valid() else [])
+            else:
                 subids = request.POST.getlist('submissions')
+            
+            if len(subids) > 0:
                 
                 #Download selected submissions
                 if 'download_many' in request.POST.get('action', []):
@@ -257,18 +275,14 @@ def assignment(request, assgnid):
                 
                 #Set AutograderResults on selected submissions to visible
                 elif 'show_reports' in request.POST.get('action', []):
-                    subs = Submission.objects.filter(pk__in=subids).prefetch_related('autograderresult')
-                    for s in subs:
-                        s.autograderresult.visible = True
-                        s.autograderresult.save()
+                    AutograderResult.objects.filter(submission__in=subids, submission__assignment=assgn) \
+                                            .update(visible=True)
                     return HttpResponseRedirect(reverse('grader:assignment', args=(assgnid,)))
                 
                 #Set AutograderResults on selected submissions to not visible
                 elif 'hide_reports' in request.POST.get('action', []):
-                    subs = Submission.objects.filter(pk__in=subids).prefetch_related('autograderresult')
-                    for s in subs:
-                        s.autograderresult.visible = False
-                        s.autograderresult.save()
+                    AutograderResult.objects.filter(submission__in=subids, submission__assignment=assgn) \
+                                            .update(visible=False)
                     return HttpResponseRedirect(reverse('grader:assignment', args=(assgnid,)))
             
             #Upload file and associated it with assignment
@@ -282,16 +296,8 @@ def assignment(request, assgnid):
         else:
             params['file_form'] = FileUploadForm(assgn.get_assignment_path())
         
-        #Get all user submissions
-        all_subs = assgn.submission_set.order_by('sub_date').reverse()
-        
-        #Get most recent submission for each student
-        params['recent_subs'] = list()
-        students_added = set()
-        for s in all_subs:
-            if not s.student in students_added:
-                params['recent_subs'].append(s)
-                students_added.add(s.student)
+        #Most recent submission of each student is loaded a page at a time by submission_table
+        params['filter_form'] = SubmissionFilterForm()
         
         #Check to show options for autograder reports
         params['show_autograde'] = assgn.autograde_mode != Assignment.MANUAL_GRADE
@@ -300,6 +306,136 @@ def assignment(request, assgnid):
     return render(request, 'grader/assignment.html', params)
 
 
+def submission_table(request, assgnid):
+    """
+    Returns a page of the instructor table of students' latest submissions as JSON
+    The query string holds a SubmissionFilterForm; each page's "after" is
+    passed back to get the next one, until it is null
+    """
+    
+    #Make sure user is logged in
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'not logged in'}, status=403)
+    
+    #Make sure user is an instructor or a TA
+    assgn = Assignment.objects.select_related('course').get(id=assgnid)
+    if not (assgn.course.has_instructor(request.user) or assgn.course.has_ta(request.user)):
+        return JsonResponse({'error': 'access denied'}, status=403)
+    
+    form = SubmissionFilterForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'error': form.errors}, status=400)
+    
+    subs, after = form.get_page(assgn)
+    scheduler.add_queue_info(subs)
+    
+    rows = list()
+    for s in subs:
+        result = getattr(s, 'autograderresult', None)
+        rows.append({'id': s.id,
+                     'student': s.student.get_full_name() or s.student.username,
+                     'url': reverse('grader:submissions', args=(assgn.id, s.student_id)),
+                     'download_url': reverse('grader:submission_download', args=(s.id,)),
+                     'sub_date': date_format(timezone.localtime(s.sub_date), 'DATETIME_FORMAT'),
+                     'status': submission_status(s, False),
+                     'queue': queue_status(s),
+                     'score': result.score if result else None,
+                     'report': ('visible' if result.visible else 'hidden') if result else None,
+                     'grade': s.grade.grade if hasattr(s, 'grade') else None})
+    
+    page = {'submissions': rows, 'after': after}
+    
+    #Number of matches, for bulk actions on the whole filter
+    if not form.cleaned_data['after']:
+        page['count'] = len(rows) if after is None else form.get_submissions(assgn).count()
+    
+    return JsonResponse(page)
+
+
+def regrade_status(request, assgnid):
+    """
+    Renders progress of the most recent regrade of an assignment
+    Once the regrade finishes, lists each submission's score before and after
+    """
+    
+    #Make sure user is logged in
+    if not request.user.is_authenticated:
+        return login_redirect(request)
+    
+    #Make sure user is an instructor or a TA
+    assgn = Assignment.objects.get(id=assgnid)
+    if not (assgn.course.has_instructor(request.user) or assgn.course.has_ta(request.user)):
+        return render(request, 'grader/access_denied.html', {'course': assgn.course})
+    
+    params = {'assgn': assgn, 'batch': assgn.regradebatch_set.order_by('created').last()}
+    
+    #Load progress counts, and the score changes once every run has finished
+    if params['batch']:
+        params['counts'] = params['batch'].get_counts()
+        if params['batch'].finished:
+            params['items'] = (params['batch'].regradeitem_set
+                               .select_related('submission__student')
+                               .order_by('submission__student__username'))
+            params['changed'] = len([i for i in params['items'] if i.old_score != i.new_score])
+    
+    return render(request, 'grader/regrade.html', params)
+
+
+def test_results(request, assgnid):
+    """
+    Renders the pass rate of each autograder test across an assignment
+    """
+    
+    #Make sure user is logged in
+    if not request.user.is_authenticated:
+        return login_redirect(request)
+    
+    #Make sure user is an instructor or a TA
+    assgn = Assignment.objects.get(id=assgnid)
+    if not (assgn.course.has_instructor(request.user) or assgn.course.has_ta(request.user)):
+        return render(request, 'grader/access_denied.html', {'course': assgn.course})
+    
+    return render(request, 'grader/tests.html', {'assgn': assgn, 'tests': assgn.get_test_stats()})
+
+
+def autograder_timings(request, assgnid=None):
+    """
+    Renders percentiles of how long each phase of an autograder run takes
+    Instructors see one assignment's runs, superusers may see every run
+    """
+    
+    #Make sure user is logged in
+    if not request.user.is_authenticated:
+        return login_redirect(request)
+    
+    #Make sure user is an instructor of the assignment, or a superuser for all runs
+    if assgnid is None:
+        if not request.user.is_superuser:
+            return render(request, 'grader/access_denied.html', {})
+        params = {'stats': metrics.get_phase_stats(), 'deps': metrics.get_deps_stats()}
+    else:
+        assgn = Assignment.objects.get(id=assgnid)
+        if not assgn.course.has_instructor(request.user):
+            return render(request, 'grader/access_denied.html', {'course': assgn.course})
+        params = {'assgn': assgn, 'stats': metrics.get_phase_stats(assgn.autogradertiming_set.all()),
+                  'deps': metrics.get_deps_stats(assgn.autogradejob_set.all())}
+    
+    params['percentiles'] = metrics.PERCENTILES
+    params['window'] = metrics.STATS_WINDOW.days
+    return render(request, 'grader/timings.html', params)
+
+
+def autograder_metrics(request):
+    """
+    Returns autograder metrics as plain text for Prometheus to scrape
+    Only served to requests with the METRICS_TOKEN bearer token
+    """
+    if not metrics.check_token(request):
+        return HttpResponseForbidden()
+    
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4')
+
+
 def submissions(request, assgnid, userid):
     """
     Renders a page for a student to view their submission
@@ -311,8 +447,10 @@ def submissions(request, assgnid, userid):
 
     #Get the submission
     student = User.objects.get(id=userid)
-    assgn = Assignment.objects.get(id=assgnid)
-    subs = Submission.objects.filter(assignment=assgn, student=student).order_by('sub_date').reverse()
+    assgn = Assignment.objects.select_related('course').get(id=assgnid)
+    subs = list(Submission.objects.filter(assignment=assgn, student=student)
+                .select_related('assignment__course', 'student', 'autograderresult', 'grade')
+                .order_by('sub_date').reverse())
     
     params = {'instructor_view': False, 'ta_view': False, 'student_view': False}
     
@@ -328,6 +466,7 @@ def submissions(request, assgnid, userid):
     
     #Load info most recent and previous submissions
     params['recent'] = subs[0]
+    scheduler.add_queue_info([params['recent']])
     params['prev'] = subs[1:]
     
     #Get status (graded, submitted, etc) for most recent submission
@@ -344,7 +483,7 @@ def submissions(request, assgnid, userid):
         params['show_report'] = subs[0].autograderresult.visible
         
         #Autograder grade should be shown if set to visible and no other grade exists
-        params['show_autograde'] = params['show_report'] and Grade.objects.filter(submission=subs[0]).count() == 0
+        params['show_autograde'] = params['show_report'] and not hasattr(subs[0], 'grade')
         
         #Load report files if required
         if params.get('instructor_view') or params.get('ta_view') or params['show_report']:
@@ -365,10 +504,7 @@ def submissions(request, assgnid, userid):
             params['file_form'] = FileUploadForm(subs[0].get_directory(subdir=Submission.SUPLEMENT_DIR))                    
         
         #Get the current grade for the submission if it exists
-        try:
-            grade = Grade.objects.get(submission=subs[0])
-        except:
-            grade = None
+        grade = getattr(subs[0], 'grade', None)
                 
         #Update grade
         if request.method == 'POST' and request.POST.get('action', None) == 'grade':
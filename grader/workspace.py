@@ -0,0 +1,230 @@
+"""
+Autograder working directories and their garbage collection
+
+Each attempt at a job works in its own directory under AUTOGRADER_WORK_DIR. Once a run
+is over its directory is renamed into a trash directory, which takes no
+time however large it is, and the actual deletion is left to collect(),
+which django-q runs every few minutes off the critical path. collect() also
+keeps AUTOGRADER_WORK_DIR under AUTOGRADER_WORK_MAX_SIZE by removing the
+least recently used directories that no unfinished job is using.
+
+Runs whose autograder and submission zips add up to at most
+AUTOGRADER_TMPFS_MAX_ZIP_SIZE, and unzip to at most
+AUTOGRADER_TMPFS_WORKSPACE_SIZE, work in RAM instead, under AUTOGRADER_TMPFS_DIR.
+Each such run holds one of the AUTOGRADER_TMPFS_BUDGET /
+AUTOGRADER_TMPFS_WORKSPACE_SIZE RAM slots shared by every worker on the host,
+and works on disk when none is free. RAM working directories are deleted as
+soon as the run is over so their slot can be reused.
+"""
+
+from django.conf import settings
+from pathlib import Path
+import logging
+import os
+import fcntl
+import shutil
+import uuid
+import zipfile
+
+from grader.models import AutogradeJob
+
+
+logger = logging.getLogger(__name__)
+
+#Directory under AUTOGRADER_WORK_DIR that discarded working directories are moved to
+TRASH_DIR = '.trash'
+
+
+def get_work_dir():
+    """
+    Returns the root directory of all working directories, creating it if needed
+    """
+    work_dir = Path(settings.AUTOGRADER_WORK_DIR)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    return work_dir
+
+
+def get_ram_dir():
+    """
+    Returns the root directory of working directories kept in RAM, creating it
+    if needed, or None if RAM working directories are disabled or unavailable
+    """
+    if not settings.AUTOGRADER_TMPFS_DIR:
+        return None
+    ram_dir = Path(settings.AUTOGRADER_TMPFS_DIR)
+    try:
+        ram_dir.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return None
+    return ram_dir
+
+
+def get_job_dir(job, in_ram=False):
+    """
+    Returns the working directory for a job's current attempt, on disk unless in_ram
+    Shards of a sharded autograder each get their own, e.g. <submission id>-<shard>.<attempt>
+    """
+    name = str(job.result.submission_id)
+    if job.shard_count > 1:
+        name = '%s-%d' % (name, job.shard_index)
+    name = '%s.%d' % (name, job.attempt)
+    return (get_ram_dir() if in_ram else get_work_dir()) / name
+
+
+def get_attempt_name(path):
+    """
+    Returns the working directory name of the attempt a file beside a working
+    directory belongs to, e.g. 12.3 for 12.3.timings
+    """
+    return '.'.join(Path(path).name.split('.')[:2])
+
+
+def acquire_ram_slot():
+    """
+    Locks a free RAM slot shared between all workers on this host
+    Returns the lock file, or None if every slot is taken; the slot is
+    released when the lock file is closed
+    """
+    ram_dir = get_ram_dir()
+    if not ram_dir:
+        return None
+    slot_dir = ram_dir / '.ramslots'
+    slot_dir.mkdir(exist_ok=True)
+
+    for i in range(settings.AUTOGRADER_TMPFS_BUDGET // settings.AUTOGRADER_TMPFS_WORKSPACE_SIZE):
+        f = open(slot_dir / str(i), 'w')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return f
+        except BlockingIOError:
+            f.close()
+
+    return None
+
+
+def get_unzipped_size(zips):
+    """
+    Returns the size of the files in zips once unzipped, in bytes, read from
+    their central directories
+    A zip that can't be read counts as infinitely large
+    """
+    size = 0
+    for z in zips:
+        try:
+            with zipfile.ZipFile(z) as f:
+                size += sum(m.file_size for m in f.infolist())
+        except (zipfile.BadZipFile, OSError):
+            return float('inf')
+    return size
+
+
+def make_job_dir(job, zips):
+    """
+    Picks the working directory for a job, in RAM if the zips are small
+    enough and a RAM slot is free
+    Returns (path, RAM slot lock or None), both to be passed to discard()
+    """
+    ram_slot = None
+    if sum(os.path.getsize(z) for z in zips) <= settings.AUTOGRADER_TMPFS_MAX_ZIP_SIZE \
+            and get_unzipped_size(zips) <= settings.AUTOGRADER_TMPFS_WORKSPACE_SIZE:
+        ram_slot = acquire_ram_slot()
+
+    path = get_job_dir(job, in_ram=bool(ram_slot))
+    #Anything left from an earlier attempt would count against the RAM budget
+    if ram_slot:
+        shutil.rmtree(path, ignore_errors=True)
+    return path, ram_slot
+
+
+def discard(path, ram_slot=None):
+    """
+    Moves a working directory to the trash, to be deleted by collect()
+    A working directory in RAM is deleted straight away, then its slot released
+    """
+    if ram_slot:
+        shutil.rmtree(path, ignore_errors=True)
+        ram_slot.close()
+        return
+
+    trash = get_work_dir() / TRASH_DIR
+    trash.mkdir(exist_ok=True)
+    try:
+        os.rename(path, trash / ('%s-%s' % (Path(path).name, uuid.uuid4().hex)))
+    except FileNotFoundError:
+        pass
+    except OSError:
+        logger.warning("Could not move %s to the trash, deleting it in place", path, exc_info=True)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def get_size(path):
+    """
+    Returns the disk space used by a directory tree in bytes
+    Hardlinked files, such as cached autograder files, are counted once
+    """
+    seen = set()
+    size = 0
+    for dirpath, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                info = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if (info.st_dev, info.st_ino) not in seen:
+                seen.add((info.st_dev, info.st_ino))
+                size += info.st_blocks * 512
+
+    return size
+
+
+def collect(max_size=None):
+    """
+    Deletes discarded working directories, then removes least recently used
+    working directories not in use by an unfinished job until the working
+    directories fit within max_size bytes
+    Returns the number of directories removed
+    """
+    if max_size is None:
+        max_size = settings.AUTOGRADER_WORK_MAX_SIZE
+
+    work_dir = get_work_dir()
+    removed = 0
+
+    trash = work_dir / TRASH_DIR
+    if trash.exists():
+        for entry in trash.iterdir():
+            shutil.rmtree(entry, ignore_errors=True)
+            removed += 1
+
+    #Only the current attempt of an unfinished job is in use
+    in_use = {get_job_dir(j).name for j in AutogradeJob.objects.exclude(state=AutogradeJob.ST_DONE)
+                                                               .select_related('result')}
+
+    #RAM working directories left by a worker that died mid-run
+    ram_dir = get_ram_dir()
+    if ram_dir:
+        for entry in ram_dir.iterdir():
+            if entry.is_dir() and not entry.name.startswith('.') and get_attempt_name(entry) not in in_use:
+                shutil.rmtree(entry, ignore_errors=True)
+                removed += 1
+
+    entries = [e for e in work_dir.iterdir() if e.is_dir() and not e.name.startswith('.')]
+    sizes = {e: get_size(e) for e in entries}
+    total = sum(sizes.values())
+    if total <= max_size:
+        return removed
+
+    for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+        if total <= max_size:
+            break
+        #Remote workers keep a job's results beside its working directory, e.g. 12.3.results
+        if get_attempt_name(entry) in in_use:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= sizes[entry]
+        removed += 1
+
+    if total > max_size:
+        logger.warning("Autograder working directories use %d bytes, over the %d byte limit", total, max_size)
+
+    return removed